@@ -10,6 +10,7 @@ field = parameters[3]
 refant = parameters[4]
 spw = parameters[5]
 minsnr = float(parameters[6])
+scans = parameters[7] if len(parameters) > 7 else ''
 
 intphase_caltable = output_path + "/" + 'intphase.gcal'
 intphase2_caltable = output_path + "/" + 'intphase{0}.gcal'.format(run_count)
@@ -30,7 +31,7 @@ if run_count > 1:
     sys.stdout.write("\n##### Finished calculating amp gains on Flux calibrator after bandpass calibration #####\n")
 
     applycal(vis=ms_dataset, field=field, gaintable=[bandpass_bcal, intphase2_caltable, amp2_caltable],
-             gainfield=[field, field, field], calwt=F, applymode='calonly')
+             gainfield=[field, field, field], calwt=F, applymode='calonly', scan=scans)
 else:
     sys.stdout.write("\n##### Started calculating intphase gains on Flux calibrator #####\n")
     gaincal(vis=ms_dataset, caltable=intphase_caltable, field=field, spw=spw, refant=refant, calmode='p', solint='60s',
@@ -42,4 +43,4 @@ else:
             minsnr=minsnr, gaintable=[intphase_caltable])
     sys.stdout.write("\n##### Finished calculating amp gains on Flux calibrator #####\n")
     applycal(vis=ms_dataset, field=field, gaintable=[intphase_caltable, amp_caltable], gainfield=[field, field],
-             calwt=F)
+             calwt=F, scan=scans)
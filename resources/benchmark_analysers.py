@@ -0,0 +1,31 @@
+#    How to run this script? (from the artip root directory, no CASA required)
+# >> python resources/benchmark_analysers.py <conf_dir_path> <output_dir>
+
+import cProfile
+import sys
+from sys import path
+
+path.append("src/main/python")
+from configs import config
+from backends.synthetic_backend import SyntheticBackend, RfiBurst
+from models.measurement_set import MeasurementSet
+from sources.flux_calibrator import FluxCalibrator
+from utilities.helpers import create_dir
+
+config.load(sys.argv[1] + "/")
+config.OUTPUT_PATH = sys.argv[2]
+create_dir(config.OUTPUT_PATH)
+
+backend = SyntheticBackend(antenna_count=30, integrations_per_scan=120,
+                           bad_antennas={5: None, 17: [1]},
+                           rfi_bursts=[RfiBurst(scan_id=1, start=40, length=5, strength=20.0)])
+measurement_set = MeasurementSet(backend.dataset_path, config.OUTPUT_PATH, backend)
+flux_calibrator = FluxCalibrator(measurement_set)
+flux_calibrator.calibrate = lambda scan_ids=None: None  # calibration needs CASA, only the analysers are benchmarked
+
+profile = cProfile.Profile()
+profile.enable()
+flux_calibrator.analyse_antennas_on_angular_dispersion_and_closure_phases()
+flux_calibrator.flag_and_calibrate_in_detail()
+profile.disable()
+profile.print_stats('cumulative')
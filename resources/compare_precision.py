@@ -0,0 +1,77 @@
+#    How to run this script? (from the artip root directory)
+# >> python resources/compare_precision.py <conf_dir_path> <output_dir> [<dataset_path> ...]
+#    Without datasets the synthetic reference datasets are compared and no CASA is required. Datasets are read
+#    through the data_source configured in pipeline.yml, use replay to compare both precisions on the same data.
+
+import os
+import sys
+from sys import path
+
+path.append("src/main/python")
+from configs import config
+from backends.synthetic_backend import SyntheticBackend, RfiBurst
+from models.measurement_set import MeasurementSet
+from sources.flux_calibrator import FluxCalibrator
+from utilities.helpers import create_dir
+
+REFERENCE_DATASETS = {
+    'quiet': dict(antenna_count=30, noise=0.1),
+    'bad_antennas': dict(antenna_count=30, noise=0.3, bad_antennas={5: None, 17: [1, 2], 23: [4]}),
+    'rfi': dict(antenna_count=30, noise=0.3, integrations_per_scan=120,
+                rfi_bursts=[RfiBurst(scan_id=1, start=40, length=5, strength=20.0),
+                            RfiBurst(scan_id=2, start=10, length=2, strength=5.0)]),
+    'noisy': dict(antenna_count=20, noise=1.0, bad_antennas={3: [2]}, seed=7),
+}
+
+
+def flag_decisions(dataset_name, precision, dataset_path=None):
+    config.PIPELINE_CONFIGS['precision'] = precision
+    config.OUTPUT_PATH = "{0}/{1}_{2}".format(output_path, dataset_name, precision)
+    create_dir(config.OUTPUT_PATH)
+    if dataset_path:
+        measurement_set = MeasurementSet(dataset_path, config.OUTPUT_PATH)
+    else:
+        backend = SyntheticBackend(**REFERENCE_DATASETS[dataset_name])
+        measurement_set = MeasurementSet(backend.dataset_path, config.OUTPUT_PATH, backend)
+    flux_calibrator = FluxCalibrator(measurement_set)
+    if not dataset_path: flux_calibrator.calibrate = lambda scan_ids=None: None  # calibration needs CASA
+
+    flux_calibrator.flag_antennas()
+    flux_calibrator.flag_and_calibrate_in_detail()
+    antenna_states = ["{0} {1} {2} {3} {4}".format(antenna.id, state.polarization, state.scan_id,
+                                                   state.get_R_phase_status(), state.get_closure_phase_status())
+                      for antenna in measurement_set.antennas() for state in antenna.get_states()]
+    if not os.path.exists(flux_calibrator.flag_file): return antenna_states, []
+    with open(flux_calibrator.flag_file) as flag_file:
+        return antenna_states, flag_file.read().splitlines()
+
+
+def compare(dataset_name, dataset_path=None):
+    states64, flags64 = flag_decisions(dataset_name, 'float64', dataset_path)
+    states32, flags32 = flag_decisions(dataset_name, 'float32', dataset_path)
+    changed_states = [(state64, state32) for state64, state32 in zip(states64, states32) if state64 != state32]
+    report = ["{0}: {1} flag entries in float64, {2} in float32, {3} antenna states differ".format(
+        dataset_name, len(flags64), len(flags32), len(changed_states))]
+    report += ["  only float64: " + entry for entry in flags64 if entry not in flags32]
+    report += ["  only float32: " + entry for entry in flags32 if entry not in flags64]
+    report += ["  state {0} -> {1}".format(state64, state32) for state64, state32 in changed_states]
+    return report, len(report) == 1
+
+
+config.load(sys.argv[1] + "/")
+output_path = sys.argv[2]
+dataset_paths = sys.argv[3:]
+
+report_lines = []
+unchanged = True
+for name, dataset in ([(dataset.rstrip('/').split('/')[-1], dataset) for dataset in dataset_paths] or
+                      [(name, None) for name in sorted(REFERENCE_DATASETS)]):
+    dataset_report, dataset_unchanged = compare(name, dataset)
+    report_lines += dataset_report
+    unchanged = unchanged and dataset_unchanged
+report_lines.append("Flag decisions are {0}".format("unchanged" if unchanged else "DIFFERENT"))
+
+with open(output_path + "/precision_report.txt", 'w') as report_file:
+    report_file.write("\n".join(report_lines) + "\n")
+print "\n".join(report_lines)
+sys.exit(0 if unchanged else 1)
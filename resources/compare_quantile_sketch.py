@@ -0,0 +1,78 @@
+#    How to run this script? (from the artip root directory)
+# >> python resources/compare_quantile_sketch.py <conf_dir_path> <output_dir> [<dataset_path> ...]
+#    Reports the error of the sketched global median and MAD sigma of detailed flagging against the exact values on
+#    the scans of the flux calibrator, read streaming with the sketch configured in pipeline.yml. Without datasets
+#    synthetic sample datasets are used and no CASA is required.
+
+import sys
+from sys import path
+
+path.append("src/main/python")
+from configs import config
+from analysers.detailed.amplitude_matrix import AmplitudeMatrix
+from backends.synthetic_backend import SyntheticBackend, RfiBurst
+from models.measurement_set import MeasurementSet
+from sources.flux_calibrator import FluxCalibrator
+from utilities.helpers import create_dir
+
+SAMPLE_DATASETS = {
+    'quiet': dict(antenna_count=30, noise=0.1),
+    'rfi': dict(antenna_count=30, noise=0.3, integrations_per_scan=240,
+                rfi_bursts=[RfiBurst(scan_id=1, start=40, length=5, strength=20.0)]),
+    'noisy': dict(antenna_count=20, noise=1.0, bad_antennas={3: [2]}, seed=7),
+}
+
+
+def scan_errors(dataset_name, dataset_path=None):
+    config.OUTPUT_PATH = "{0}/{1}".format(output_path, dataset_name)
+    create_dir(config.OUTPUT_PATH)
+    if dataset_path:
+        measurement_set = MeasurementSet(dataset_path, config.OUTPUT_PATH)
+    else:
+        backend = SyntheticBackend(**SAMPLE_DATASETS[dataset_name])
+        measurement_set = MeasurementSet(backend.dataset_path, config.OUTPUT_PATH, backend)
+    flux_calibrator = FluxCalibrator(measurement_set)
+
+    report = []
+    within_bounds = True
+    for polarization in config.GLOBAL_CONFIGS['polarizations']:
+        for scan_id in measurement_set.scan_ids(flux_calibrator.source_ids, polarization):
+            amp_matrix = AmplitudeMatrix(measurement_set, polarization, scan_id, config.GLOBAL_CONFIGS['default_spw'],
+                                         flux_calibrator.config)
+            sketched_median, sketched_mad_sigma = amp_matrix.scan_statistics()
+            median, mad_sigma = amp_matrix.median(), amp_matrix.mad_sigma()
+            median_error = abs(sketched_median - median)
+            mad_sigma_error = abs(sketched_mad_sigma - mad_sigma)
+            median_bound = sketch_config['relative_accuracy'] * median
+            mad_sigma_bound = 1.4826 * sketch_config['relative_accuracy'] * (2 * median + amp_matrix.mad())
+            scan_within_bounds = median_error <= median_bound and mad_sigma_error <= mad_sigma_bound
+            within_bounds = within_bounds and scan_within_bounds
+            report.append("{0} {1} scan {2}: {3} readings, median {4:.6g} off by {5:.3g} (bound {6:.3g}), "
+                          "mad sigma {7:.6g} off by {8:.3g} (bound {9:.3g}){10}".format(
+                           dataset_name, polarization, scan_id, amp_matrix.count_non_nan(), median, median_error,
+                           median_bound, mad_sigma, mad_sigma_error, mad_sigma_bound,
+                           "" if scan_within_bounds else " EXCEEDED"))
+    return report, within_bounds
+
+
+config.load(sys.argv[1] + "/")
+output_path = sys.argv[2]
+dataset_paths = sys.argv[3:]
+config.PIPELINE_CONFIGS['streaming']['enabled'] = True
+sketch_config = config.PIPELINE_CONFIGS['quantile_sketch']
+sketch_config['enabled'] = True
+
+report_lines = ["Quantile sketch with relative accuracy {0} and at most {1} buckets".format(
+    sketch_config['relative_accuracy'], sketch_config['max_buckets'])]
+all_within_bounds = True
+for name, dataset in ([(dataset.rstrip('/').split('/')[-1], dataset) for dataset in dataset_paths] or
+                      [(name, None) for name in sorted(SAMPLE_DATASETS)]):
+    dataset_report, dataset_within_bounds = scan_errors(name, dataset)
+    report_lines += dataset_report
+    all_within_bounds = all_within_bounds and dataset_within_bounds
+report_lines.append("Sketch errors are {0}".format("within bounds" if all_within_bounds else "OUT OF BOUNDS"))
+
+with open(output_path + "/quantile_sketch_report.txt", 'w') as report_file:
+    report_file.write("\n".join(report_lines) + "\n")
+print "\n".join(report_lines)
+sys.exit(0 if all_within_bounds else 1)
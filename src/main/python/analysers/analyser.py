@@ -1,4 +1,26 @@
+import itertools
+import multiprocessing
+import numpy
+
 from configs import config
+from models.antenna_state_store import AntennaStateStore
+from models.calib_params import CalibParams
+from utilities.logger import logger
+from utilities.terminal_color import Color
+
+_worker_analyser = None
+
+
+def _initialise_worker(analyser):
+    # runs in every pool process, which is forked with its own copy of the analyser and measurement set
+    global _worker_analyser
+    _worker_analyser = analyser
+    analyser.measurement_set.use_worker_backend()
+
+
+def _analyse_in_worker(work_item):
+    return _worker_analyser._antenna_status_codes(*work_item)
+
 
 class Analyser(object):
     def __init__(self, measurement_set, source):
@@ -7,4 +29,62 @@ class Analyser(object):
         self.source_ids = source.source_ids
 
     def identify_antennas_status(self):
+        work_items = self._work_items()
+        for (spw, polarization, scan_id), status_codes in itertools.izip(work_items, self._analysed(work_items)):
+            self._update_antenna_states(polarization, scan_id, status_codes)
+
+    def _update_antenna_states(self, polarization, scan_id, status_codes):
+        for antenna, status_code in zip(self.measurement_set.antennas(polarization, scan_id), status_codes):
+            status = AntennaStateStore.STATUSES[status_code]
+            if status: self._update_antenna_status(antenna, polarization, scan_id, status)
+
+    def _work_items(self):
+        work_items = []
+        for polarization in config.GLOBAL_CONFIGS['polarizations']:
+            scan_ids = self.measurement_set.scan_ids(self.source_ids, polarization)
+            work_items += list(itertools.product([config.GLOBAL_CONFIGS['default_spw']], [polarization], scan_ids))
+        return work_items
+
+    def _analysed(self, work_items):
+        processes = min(config.PIPELINE_CONFIGS['parallel']['initial_analysis_processes'], len(work_items))
+        if processes > 1 and self.measurement_set.reads_in_workers():
+            return self._analysed_in_pool(work_items, processes)
+        return (self._antenna_status_codes(*work_item) for work_item in
+                self.measurement_set.prefetched(work_items, self._channel(), [self._data_column()]))
+
+    def _analysed_in_pool(self, work_items, processes):
+        logger.debug("Analysing {0} scans in {1} processes".format(len(work_items), processes))
+        pool = multiprocessing.Pool(processes, _initialise_worker, (self,))
+        try:
+            # results come back in the order of the work items, states are updated exactly as in a serial run
+            for status_codes in pool.imap(_analyse_in_worker, work_items):
+                yield status_codes
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _channel(self):
+        calib_params = CalibParams(*self.source_config['calib_params'])
+        return {'start': calib_params.channel, 'width': calib_params.width}
+
+    def _get_data(self, spw, polarization, scan_id, data_column):
+        return self.measurement_set.get_data(spw, self._channel(), polarization, {'scan_number': scan_id},
+                                             ["antenna1", "antenna2", data_column, 'flag'])
+
+    def _status_codes(self, statuses):
+        return numpy.array([AntennaStateStore.STATUSES.index(status) for status in statuses], dtype=numpy.int8)
+
+    def _data_column(self):
+        raise NotImplementedError("Not implemented")
+
+    def _antenna_status_codes(self, spw, polarization, scan_id):
+        logger.debug(Color.BACKGROUD_WHITE + "Polarization =" + polarization + " Scan Id=" + str(scan_id) + Color.ENDC)
+        return self.status_codes_for(self._get_data(spw, polarization, scan_id, self._data_column()), polarization,
+                                     scan_id)
+
+    def status_codes_for(self, visibility_data, polarization, scan_id):
+        # status codes of the unflagged antennas of the scan, 0 where the analysis leaves the state as it is
+        raise NotImplementedError("Not implemented")
+
+    def _update_antenna_status(self, antenna, polarization, scan_id, status):
         raise NotImplementedError("Not implemented")
@@ -1,82 +1,174 @@
 import numpy
 
+from analysers.detailed.quantile_sketch import QuantileSketch
+from analysers.detailed.rolling_statistics import RollingStatistics
+from configs import config
+from models.baseline import Baseline
 from models.calib_params import CalibParams
 from utilities.logger import logger
 from utilities.terminal_color import Color
 
 
 class AmplitudeMatrix:
-    def __init__(self, measurement_set, polarization, scan_id, spw, config, matrix={}):
+    def __init__(self, measurement_set, polarization, scan_id, spw, config, matrix=None, baselines=None, times=None):
         self._measurement_set = measurement_set
         self._polarization = polarization
         self._spw = spw
         self._scan_id = scan_id
         self._config = config
-        self.amplitude_data_matrix = self._generate_matrix() if measurement_set else matrix
+        self._statistics = {}
+        self._sketch = None  # of the scan amplitudes, fed by the chunks of a streamed read
+        if measurement_set:
+            self._matrix, self._baselines, self._times = self._generate_matrix()
+        else:
+            # [baseline, time] amplitudes with flagged readings as NaN, (antenna1, antenna2) rows and MJD second columns
+            self._matrix, self._baselines, self._times = matrix, baselines, times
 
     def _generate_matrix(self):
         baselines = self._measurement_set.baselines(self._polarization, self._scan_id)
-        amplitude_data_matrix = {}
+        if config.PIPELINE_CONFIGS['streaming']['enabled']:
+            return self._streamed_matrix(baselines)
         matrix_data = self._matrix_data()
 
-        for baseline in baselines:
-            baseline_index = matrix_data.baseline_index((baseline.antenna1, baseline.antenna2))
-            if not numpy.isnan(baseline_index):
-                amplitude_data_matrix[baseline] = matrix_data.mask_baseline_data(baseline_index)
-        return amplitude_data_matrix
-
-    def _matrix_data(self):
+        baseline_ids = [(baseline.antenna1, baseline.antenna2) for baseline in baselines]
+        baseline_rows = [matrix_data.baseline_index(baseline_id) for baseline_id in baseline_ids]
+        present = [not numpy.isnan(baseline_row) for baseline_row in baseline_rows]
+        rows = numpy.array(baseline_rows)[present].astype(int)
+        baseline_ids = numpy.array(baseline_ids, dtype=int).reshape(-1, 2)[present]
+        return matrix_data.masked_rows(rows), baseline_ids, matrix_data.time
+
+    def _streamed_matrix(self, baselines):
+        baseline_ids = numpy.array([(baseline.antenna1, baseline.antenna2) for baseline in baselines],
+                                   dtype=int).reshape(-1, 2)
+        # the visibilities are read a chunk at a time, the amplitudes of the scan are held once in the matrix that every
+        # chunk is merged into
+        times = self._measurement_set.timesforscan(self._scan_id)
+        sketch_config = config.PIPELINE_CONFIGS['quantile_sketch']
+        if sketch_config['enabled']:
+            self._sketch = QuantileSketch(sketch_config['relative_accuracy'], sketch_config['max_buckets'])
+        matrix = None
+        present = numpy.zeros(len(baseline_ids), dtype=bool)
+        for chunk in self._measurement_set.iter_data(*self._data_selection()):
+            if matrix is None:
+                matrix = numpy.full((len(baseline_ids), len(times)), numpy.nan, dtype=chunk.data.dtype)
+            rows = numpy.array([chunk.baseline_index(baseline_id) for baseline_id in baseline_ids])
+            chunk_present = numpy.logical_not(numpy.isnan(rows))
+            columns, known = self._columns_for(times, chunk.time)
+            block = numpy.full((len(baseline_ids), columns.size), numpy.nan, dtype=matrix.dtype)
+            block[chunk_present] = chunk.masked_rows(rows[chunk_present].astype(int))[:, known]
+            present |= chunk_present
+            # a chunk may end within an integration, its readings are merged with those of the next chunk
+            previous = matrix[:, columns]
+            if self._sketch is not None:
+                self._sketch.add(block)
+                self._sketch.remove(numpy.where(numpy.isnan(block), numpy.nan, previous))
+            matrix[:, columns] = numpy.where(numpy.isnan(block), previous, block)
+
+        if matrix is None: matrix = numpy.full((len(baseline_ids), len(times)), numpy.nan)
+        # baselines without readings are dropped by moving the others up rather than copying the matrix
+        present_rows = present.nonzero()[0]
+        for row, present_row in enumerate(present_rows):
+            if row != present_row: matrix[row] = matrix[present_row]
+        return matrix[:len(present_rows)], baseline_ids[present], times
+
+    def _columns_for(self, times, chunk_times):
+        # matrix columns of the chunk integrations, those missing from the scan times are left out
+        columns = numpy.minimum(numpy.searchsorted(times, chunk_times), len(times) - 1)
+        known = times[columns] == chunk_times if len(times) else numpy.zeros(len(chunk_times), dtype=bool)
+        if not known.all():
+            logger.warning(Color.WARNING + "Skipped {0} integrations of scan {1} missing from its times".format(
+                numpy.count_nonzero(~known), self._scan_id) + Color.ENDC)
+        return columns[known], known
+
+    def _data_selection(self):
         calib_params = CalibParams(*self._config['calib_params'])
         amplitude_data_column = self._config['detail_flagging']['amplitude_data_column']
-        visibility_data = self._measurement_set.get_data(self._spw, {'start': calib_params.channel,
-                                                                     'width': calib_params.width},
-                                                         self._polarization, {'scan_number': self._scan_id},
-                                                         ["antenna1", "antenna2", amplitude_data_column, 'flag',
-                                                          'time'])
-        return visibility_data
+        return (self._spw, {'start': calib_params.channel, 'width': calib_params.width}, self._polarization,
+                {'scan_number': self._scan_id}, ["antenna1", "antenna2", amplitude_data_column, 'flag', 'time'])
 
-    def filter_by_antenna(self, antenna_id):
-        antenna_matrix = dict((baseline, amp_data) for baseline, amp_data in self.amplitude_data_matrix.iteritems() if
-                              baseline.contains(antenna_id))
+    def _matrix_data(self):
+        return self._measurement_set.get_data(*self._data_selection())
+
+    def _view(self, rows, times=slice(None)):
+        if isinstance(rows, slice):
+            matrix, baselines = self._matrix[rows, times], self._baselines[rows]
+        else:
+            matrix, baselines = self._matrix[:, times][rows], self._baselines[rows]
+        return AmplitudeMatrix(None, None, None, None, self._config, matrix, baselines, self._times[times])
+
+    def baselines(self):
+        return [Baseline(antenna1, antenna2) for antenna1, antenna2 in self._baselines]
+
+    def _antenna_rows(self, antenna_id):
+        return numpy.logical_or(self._baselines[:, 0] == antenna_id, self._baselines[:, 1] == antenna_id)
 
-        return AmplitudeMatrix(None, None, None, None, self._config, antenna_matrix)
+    def _baseline_rows(self, baseline):
+        return numpy.logical_and(self._baselines[:, 0] == baseline.antenna1, self._baselines[:, 1] == baseline.antenna2)
+
+    def filter_by_antenna(self, antenna_id):
+        return self._view(self._antenna_rows(antenna_id).nonzero()[0])
 
     def filter_by_baseline(self, baseline):
-        return AmplitudeMatrix(None, None, None, None, self._config,
-                               {baseline: self.amplitude_data_matrix[baseline]})
+        row = self._baseline_rows(baseline).nonzero()[0][0]
+        return self._view(slice(row, row + 1))
+
+    def mask_readings(self, start_time, end_time, antenna_id=None, baseline=None):
+        # flags the readings between the MJD seconds in place as flagdata does in the dataset, on all baselines unless
+        # one is given
+        if baseline is not None:
+            rows = self._baseline_rows(baseline)
+        elif antenna_id is not None:
+            rows = self._antenna_rows(antenna_id)
+        else:
+            rows = slice(None)
+        start, end = numpy.searchsorted(self._times, start_time), numpy.searchsorted(self._times, end_time, 'right')
+        if self._sketch is not None: self._sketch.remove(self._matrix[rows, start:end])
+        self._matrix[rows, start:end] = numpy.nan
+        self._statistics = {}
+
+    def filter_by_time(self, start, end):
+        return self._view(slice(None), slice(start, end))
 
     def readings_count(self):
-        return len(self.amplitude_data_matrix[list(self.amplitude_data_matrix)[0]])
+        return self._matrix.shape[1]
+
+    def _cached(self, statistic, compute):
+        if statistic not in self._statistics:
+            self._statistics[statistic] = compute()
+        return self._statistics[statistic]
 
     def is_nan(self):
-        return all(numpy.isnan(amp) for amp in numpy.array(self.amplitude_data_matrix.values()).flatten())
+        return self._cached('is_nan', lambda: self.count_non_nan() == 0)
 
     def count_non_nan(self):
-        data = numpy.array(self.amplitude_data_matrix.values()).flatten()
-        return numpy.isfinite(data).sum()
+        return self._cached('count_non_nan', lambda: numpy.count_nonzero(numpy.isfinite(self._matrix)))
 
     def median(self):
         if self.is_nan(): return numpy.nan
-        return numpy.nanmedian(self.amplitude_data_matrix.values())
+        return self._cached('median', lambda: numpy.nanmedian(self._matrix))
 
     def mad(self):
         if self.is_nan(): return numpy.nan
-        matrix = self.amplitude_data_matrix.values()
-        return numpy.nanmedian(abs(numpy.array(matrix) - numpy.nanmedian(matrix)))
+        return self._cached('mad', lambda: numpy.nanmedian(abs(self._matrix - self.median())))
 
     def mad_sigma(self):
         return 1.4826 * self.mad()
 
+    def scan_statistics(self):
+        # global median and MAD sigma the windows of the scan are judged against, sketched while streaming if configured
+        if self._sketch is None: return self.median(), self.mad_sigma()
+        return self._sketch.median(), 1.4826 * self._sketch.mad()
+
     def mean(self):
         if self.is_nan(): return numpy.nan
-        return numpy.nanmean(self.amplitude_data_matrix.values())
+        return self._cached('mean', lambda: numpy.nanmean(self._matrix))
 
     def mean_sigma(self):
         if self.is_nan(): return numpy.nan
-        return numpy.nanstd(self.amplitude_data_matrix.values())
+        return self._cached('mean_sigma', lambda: numpy.nanstd(self._matrix))
 
     def is_empty(self):
-        return len(numpy.array(self.amplitude_data_matrix.values()).flatten()) == 0
+        return self._matrix.size == 0
 
     def has_sufficient_data(self, window_config):
         threshold = window_config.window_size - window_config.overlap
@@ -89,19 +181,33 @@ class AmplitudeMatrix:
         deviated_median = self._deviated_median(global_median, deviation_threshold, matrix_median)
         scattered_amplitude = self._scattered_amplitude(deviation_threshold, matrix_sigma)
         if deviated_median or scattered_amplitude:
-            # logger.debug(Color.UNDERLINE + "matrix=" + str(self.amplitude_data_matrix) + Color.ENDC)
-            logger.debug(Color.UNDERLINE + " median=" + str(matrix_median) + ", median sigma=" + str(matrix_sigma)
-                         + ", mean=" + str(self.mean()) + ", mean sigma=" + str(self.mean_sigma()) + Color.ENDC)
-            logger.debug(Color.WARNING + "median deviated=" + str(deviated_median) + ", amplitude scattered=" + str(
-                scattered_amplitude) + Color.ENDC)
+            self.log_deviation(matrix_median, matrix_sigma, deviated_median, scattered_amplitude)
         return deviated_median or scattered_amplitude
 
+    def log_deviation(self, matrix_median, matrix_sigma, deviated_median, scattered_amplitude):
+        # logger.debug(Color.UNDERLINE + "matrix=" + str(self._matrix) + Color.ENDC)
+        logger.debug(Color.UNDERLINE + " median=" + str(matrix_median) + ", median sigma=" + str(matrix_sigma)
+                     + ", mean=" + str(self.mean()) + ", mean sigma=" + str(self.mean_sigma()) + Color.ENDC)
+        logger.debug(Color.WARNING + "median deviated=" + str(deviated_median) + ", amplitude scattered=" + str(
+            scattered_amplitude) + Color.ENDC)
+
+    def rolling_statistics(self, window_config, per_baseline=False):
+        # windows over all readings at once, or over the readings of every baseline separately
+        matrix = self._matrix[:, numpy.newaxis] if per_baseline else self._matrix[numpy.newaxis]
+        return RollingStatistics(matrix, window_config)
+
     def _deviated_median(self, global_median, deviation_threshold, actual_median):
         return abs(actual_median - global_median) > deviation_threshold
 
     def _scattered_amplitude(self, deviation_threshold, actual_sigma):
         return actual_sigma > deviation_threshold
 
+    def __getstate__(self):
+        # sent back from detailed flagging workers with the amplitudes, not with the measurement set they were read from
+        state = self.__dict__.copy()
+        state['_measurement_set'] = None
+        return state
+
     def __repr__(self):
-        return "AmpMatrix=" + str(self.amplitude_data_matrix) + " med=" + \
+        return "AmpMatrix=" + str(dict(zip(self.baselines(), self._matrix.tolist()))) + " med=" + \
                str(self.median()) + " mad sigma=" + str(self.mad_sigma())
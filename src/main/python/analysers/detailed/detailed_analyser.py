@@ -1,111 +1,216 @@
+import itertools
+import multiprocessing
+import numpy
+from configs import config
 from utilities.logger import logger
 from amplitude_matrix import AmplitudeMatrix
-from window import Window, WindowConfig
+from window import WindowConfig
 from casa.flag_reasons import BAD_ANTENNA_TIME, BAD_BASELINE_TIME, BAD_TIME
+from models.calib_params import CalibParams
+from models.visibility_data import VisibilityData
 from utilities.terminal_color import Color
 
+_worker_analyser = None
+
+
+def _initialise_worker(analyser):
+    # runs in every pool process, which is forked with its own copy of the analyser and the amplitudes it keeps
+    global _worker_analyser
+    _worker_analyser = analyser
+    analyser.measurement_set.use_worker_backend()
+
+
+def _analyse_in_worker(work_item):
+    return _worker_analyser._bad_windows(*work_item)
+
 
 class DetailedAnalyser:
     def __init__(self, measurement_set, source_config, flag_file):
         self.measurement_set = measurement_set
         self._source_config = source_config
         self.flag_file = flag_file
+        self._amplitude_matrices = {}  # (spw, polarization, scan id) -> amplitudes kept across passes
+        self._flagged_windows = []  # masked in the kept amplitudes once flagdata has applied them
+        self._data_version = self._flag_version = None
+        self._flags_per_spw = config.PIPELINE_CONFIGS['detailed_flagging']['all_spws']
+        self.rereads_avoided = 0
 
     def analyse_time(self, spw_polarization_and_scan_product):
         logger.info(Color.HEADER + "Started detailed flagging on time" + Color.ENDC)
-        bad_window_present = False
-        for spw, polarization, scan_id in spw_polarization_and_scan_product:
-            scan_times = self.measurement_set.timesforscan(scan_id)
-            amp_matrix = AmplitudeMatrix(self.measurement_set, polarization, scan_id, spw, self._source_config)
-            global_median = amp_matrix.median()
-            global_sigma = amp_matrix.mad_sigma()
-            self._print_polarization_details(global_sigma, global_median, polarization, scan_id)
-
-            window_config = WindowConfig(*self._source_config['detail_flagging']['time_sliding_window'])
-            # Sliding Window for Time
-            flagged_bad_window = self._flag_bad_time_window(BAD_TIME, None, amp_matrix.amplitude_data_matrix,
-                                       global_sigma, global_median,
-                                       scan_times, polarization, scan_id, window_config)
-            if flagged_bad_window: bad_window_present = True
-
-        return bad_window_present
+        return self._analyse(BAD_TIME, spw_polarization_and_scan_product)
 
     def analyse_antennas(self, spw_polarization_and_scan_product):
         logger.info(Color.HEADER + "Started detailed flagging on all unflagged antennas" + Color.ENDC)
-        bad_window_present = False
-        for spw, polarization, scan_id in spw_polarization_and_scan_product:
-            scan_times = self.measurement_set.timesforscan(scan_id)
-            amp_matrix = AmplitudeMatrix(self.measurement_set, polarization, scan_id, spw, self._source_config)
-            global_median = amp_matrix.median()
-            global_sigma = amp_matrix.mad_sigma()
-            self._print_polarization_details(global_sigma, global_median, polarization, scan_id)
-
-            antennaids = self.measurement_set.antenna_ids(polarization, scan_id)
-
-            window_config = WindowConfig(*self._source_config['detail_flagging']['antenna_sliding_window'])
-            # Sliding Window for Bad Antennas
-            for antenna in antennaids:
-                filtered_matrix = amp_matrix.filter_by_antenna(antenna)
-                if filtered_matrix.has_sufficient_data(window_config) and filtered_matrix.is_bad(global_median, window_config.mad_scale_factor * global_sigma):
-                    logger.info(
-                        Color.FAIL + 'Antenna ' + str(
-                            antenna) + ' is Bad running sliding Window on it' + Color.ENDC)
-                    flagged_bad_window = self._flag_bad_time_window(BAD_ANTENNA_TIME, antenna,
-                                                                    filtered_matrix.amplitude_data_matrix,
-                                                                    global_sigma,
-                                                                    global_median, scan_times, polarization, scan_id,
-                                                                    window_config)
-                    if flagged_bad_window: bad_window_present = True
-
-        return bad_window_present
+        return self._analyse(BAD_ANTENNA_TIME, spw_polarization_and_scan_product)
 
     def analyse_baselines(self, spw_polarization_and_scan_product):
-        bad_window_present = False
         logger.info(Color.HEADER + "Started detailed flagging on all baselines" + Color.ENDC)
-        for spw, polarization, scan_id in spw_polarization_and_scan_product:
-            amp_matrix = AmplitudeMatrix(self.measurement_set, polarization, scan_id, spw, self._source_config)
-            global_median = amp_matrix.median()
-            global_sigma = amp_matrix.mad_sigma()
-            scan_times = self.measurement_set.timesforscan(scan_id)
-            self._print_polarization_details(global_sigma, global_median, polarization, scan_id)
-
-            window_config = WindowConfig(*self._source_config['detail_flagging']['baseline_sliding_window'])
-            # Sliding Window for Baselines
-            for (baseline, amplitudes) in amp_matrix.amplitude_data_matrix.items():
-                flagged_bad_window = self._flag_bad_time_window(BAD_BASELINE_TIME, baseline, {baseline: amplitudes},
-                                                                global_sigma, global_median,
-                                                                scan_times, polarization, scan_id, window_config)
-                if flagged_bad_window: bad_window_present = True
-
-        return bad_window_present
-
-    def _flag_bad_time_window(self, reason, element_id, data_set, global_sigma, global_median, scan_times, polarization,
-                              scan_id, window_config):
-        bad_window_found = False
-        sliding_window = Window(data_set, window_config)
-        while True:
-            window_matrix = sliding_window.slide()
-            if window_matrix.has_sufficient_data(window_config) and window_matrix.is_bad(global_median, window_config.mad_scale_factor * global_sigma):
-                bad_window_found = True
-                start, end = sliding_window.current_position()
-                bad_timerange = scan_times[start], scan_times[end]
-
-                if reason == BAD_TIME:
-                    self.measurement_set.flag_bad_time(self.flag_file, polarization, scan_id, bad_timerange)
-                    logger.debug('Time=' + ' was bad between' + scan_times[
-                        start] + '[index=' + str(start) + '] and ' + scan_times[end] + '[index=' + str(end) + ']\n')
-
-                elif reason == BAD_ANTENNA_TIME:
-                    self.measurement_set.flag_bad_antenna_time(self.flag_file,polarization, scan_id, element_id, bad_timerange)
-                    logger.debug('Antenna=' + str(element_id) + ' was bad between' + scan_times[
-                        start] + '[index=' + str(start) + '] and ' + scan_times[end] + '[index=' + str(end) + ']\n')
-                else:
-                    self.measurement_set.flag_bad_baseline_time(self.flag_file,polarization, scan_id, element_id, bad_timerange)
-                    logger.debug('Baseline=' + str(element_id) + ' was bad between' + scan_times[
-                        start] + '[index=' + str(start) + '] and ' + scan_times[end] + '[index=' + str(end) + ']\n')
-
-            if sliding_window.reached_end_of_collection(): break
-        return bad_window_found
+        return self._analyse(BAD_BASELINE_TIME, spw_polarization_and_scan_product)
+
+    def _analyse(self, reason, spw_polarization_and_scan_product):
+        # bad windows are flagged in the order of the work items, wherever they were found
+        self._refresh_amplitude_matrices()
+        work_items = list(spw_polarization_and_scan_product)
+        flagged_items = set()  # (spw, polarization, scan id) with bad windows
+        for work_item, (bad_windows, read_matrix) in itertools.izip(work_items,
+                                                                    self._analysed(reason, work_items)):
+            if read_matrix is None:
+                self.rereads_avoided += 1
+            else:
+                self._amplitude_matrices[work_item] = read_matrix
+            for bad_window in bad_windows:
+                self._flag_bad_window(work_item[0], *bad_window)
+            if bad_windows: flagged_items.add(work_item)
+        logger.debug("Amplitudes of {0} scans kept in memory, {1} re-reads avoided so far".format(
+            len(self._amplitude_matrices), self.rereads_avoided))
+        return flagged_items
+
+    def _analysed(self, reason, work_items):
+        processes = min(config.PIPELINE_CONFIGS['parallel']['detailed_analysis_processes'], len(work_items))
+        if processes > 1 and self.measurement_set.reads_in_workers():
+            return self._analysed_in_pool(reason, work_items, processes)
+        return (self._bad_windows(reason, *work_item) for work_item in self._prefetched(work_items))
+
+    def _analysed_in_pool(self, reason, work_items, processes):
+        logger.debug("Analysing {0} scans in {1} processes".format(len(work_items), processes))
+        pool = multiprocessing.Pool(processes, _initialise_worker, (self,))
+        try:
+            for bad_windows in pool.imap(_analyse_in_worker, [(reason,) + work_item for work_item in work_items]):
+                yield bad_windows
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _bad_windows(self, reason, spw, polarization, scan_id):
+        # bad windows of a scan as (reason, element, polarization, scan id, start, end), with the amplitudes read for
+        # it unless they were kept in memory
+        amp_matrix = self._amplitude_matrices.get((spw, polarization, scan_id))
+        read_matrix = None
+        if amp_matrix is None:
+            amp_matrix = read_matrix = AmplitudeMatrix(self.measurement_set, polarization, scan_id, spw,
+                                                       self._source_config)
+        global_median, global_sigma = amp_matrix.scan_statistics()
+        self._print_polarization_details(global_sigma, global_median, polarization, scan_id)
+
+        if reason == BAD_TIME:
+            bad_windows = self._bad_time_windows(amp_matrix, global_sigma, global_median, polarization, scan_id)
+        elif reason == BAD_ANTENNA_TIME:
+            bad_windows = self._bad_antenna_windows(amp_matrix, global_sigma, global_median, polarization, scan_id)
+        else:
+            bad_windows = self._bad_baseline_windows(amp_matrix, global_sigma, global_median, polarization, scan_id)
+        return bad_windows, read_matrix
+
+    def _bad_time_windows(self, amp_matrix, global_sigma, global_median, polarization, scan_id):
+        window_config = WindowConfig(*self._source_config['detail_flagging']['time_sliding_window'])
+        # Sliding Window for Time
+        return self._bad_time_window(BAD_TIME, None, amp_matrix, global_sigma, global_median, polarization, scan_id,
+                                     window_config)
+
+    def _bad_antenna_windows(self, amp_matrix, global_sigma, global_median, polarization, scan_id):
+        bad_windows = []
+        antennaids = self.measurement_set.antenna_ids(polarization, scan_id)
+
+        window_config = WindowConfig(*self._source_config['detail_flagging']['antenna_sliding_window'])
+        # Sliding Window for Bad Antennas
+        for antenna in antennaids:
+            filtered_matrix = amp_matrix.filter_by_antenna(antenna)
+            if filtered_matrix.has_sufficient_data(window_config) and filtered_matrix.is_bad(global_median, window_config.mad_scale_factor * global_sigma):
+                logger.info(
+                    Color.FAIL + 'Antenna ' + str(
+                        antenna) + ' is Bad running sliding Window on it' + Color.ENDC)
+                bad_windows += self._bad_time_window(BAD_ANTENNA_TIME, antenna, filtered_matrix, global_sigma,
+                                                     global_median, polarization, scan_id, window_config)
+        return bad_windows
+
+    def _bad_baseline_windows(self, amp_matrix, global_sigma, global_median, polarization, scan_id):
+        bad_windows = []
+        window_config = WindowConfig(*self._source_config['detail_flagging']['baseline_sliding_window'])
+        # Sliding Window for Baselines
+        rolling_statistics = amp_matrix.rolling_statistics(window_config, per_baseline=True)
+        deviations = rolling_statistics.deviations(global_median, window_config.mad_scale_factor * global_sigma)
+        for group, baseline in enumerate(amp_matrix.baselines()):
+            if not (deviations[0][group].any() or deviations[1][group].any()): continue
+            bad_windows += self._deviating_windows(BAD_BASELINE_TIME, baseline, amp_matrix.filter_by_baseline(baseline),
+                                                   rolling_statistics, deviations, group, polarization, scan_id)
+        return bad_windows
+
+    def _prefetched(self, spw_polarization_and_scan_product):
+        # only the scans that are not kept in memory are read, and so prefetched
+        calib_params = CalibParams(*self._source_config['calib_params'])
+        amplitude_data_column = self._source_config['detail_flagging']['amplitude_data_column']
+        work_items = list(spw_polarization_and_scan_product)
+        reads = self.measurement_set.prefetched([work_item for work_item in work_items if
+                                                 work_item not in self._amplitude_matrices],
+                                                {'start': calib_params.channel, 'width': calib_params.width},
+                                                [amplitude_data_column])
+        for work_item in work_items:
+            if work_item not in self._amplitude_matrices: next(reads)
+            yield work_item
+
+    def _refresh_amplitude_matrices(self):
+        amplitude_data_column = self._source_config['detail_flagging']['amplitude_data_column']
+        data_version = self.measurement_set.data_version(VisibilityData.COMPLEX_COLUMN_FOR[amplitude_data_column])
+        flag_version = self.measurement_set.flag_version()
+        flags_changed = flag_version != self._flag_version
+        if data_version != self._data_version or flags_changed != bool(self._flagged_windows):
+            # a calibration rewrote the amplitudes, flags changed that were not flagged here
+            # or the windows flagged here were not applied to the dataset yet
+            self._amplitude_matrices.clear()
+        elif self._flagged_windows:
+            for spw, polarization, scan_id, start_time, end_time, antenna_id, baseline in self._flagged_windows:
+                for (matrix_spw, matrix_polarization, matrix_scan_id), amp_matrix in \
+                        self._amplitude_matrices.iteritems():
+                    if (matrix_polarization, matrix_scan_id) == (polarization, scan_id) and spw in (None, matrix_spw):
+                        amp_matrix.mask_readings(start_time, end_time, antenna_id, baseline)
+        self._flagged_windows = []
+        self._data_version, self._flag_version = data_version, flag_version
+
+    def _bad_time_window(self, reason, element_id, amp_matrix, global_sigma, global_median, polarization, scan_id,
+                         window_config):
+        rolling_statistics = amp_matrix.rolling_statistics(window_config)
+        deviations = rolling_statistics.deviations(global_median, window_config.mad_scale_factor * global_sigma)
+        return self._deviating_windows(reason, element_id, amp_matrix, rolling_statistics, deviations, 0,
+                                       polarization, scan_id)
+
+    def _deviating_windows(self, reason, element_id, amp_matrix, rolling_statistics, deviations, group, polarization,
+                           scan_id):
+        deviated_medians, scattered_amplitudes = deviations[0][group], deviations[1][group]
+        mad_sigmas = rolling_statistics.mad_sigmas()[group]
+        bad_windows = []
+        for window in numpy.flatnonzero(numpy.logical_or(deviated_medians, scattered_amplitudes)):
+            start, end = rolling_statistics.starts[window], rolling_statistics.ends[window]
+            amp_matrix.filter_by_time(start, end + 1).log_deviation(rolling_statistics.medians[group, window],
+                                                                   mad_sigmas[window], deviated_medians[window],
+                                                                   scattered_amplitudes[window])
+            bad_windows.append((reason, element_id, polarization, scan_id, start, end))
+        return bad_windows
+
+    def _flag_bad_window(self, spw, reason, element_id, polarization, scan_id, start, end):
+        # flags of the default spw apply to all spws, unless every spw is analysed on its own
+        flagged_spw = spw if self._flags_per_spw else None
+        scan_times = self.measurement_set.timesforscan(scan_id)
+        bad_timerange = scan_times[start], scan_times[end]
+        # masked over the padded timerange CASA flags, which may take in neighbouring integrations
+        start_time, end_time = self.measurement_set.flagged_time_bounds(bad_timerange)
+        self._flagged_windows.append((flagged_spw, polarization, scan_id, start_time, end_time,
+                                      element_id if reason == BAD_ANTENNA_TIME else None,
+                                      element_id if reason == BAD_BASELINE_TIME else None))
+
+        if reason == BAD_TIME:
+            self.measurement_set.flag_bad_time(self.flag_file, polarization, scan_id, bad_timerange, flagged_spw)
+            logger.debug('Time=' + ' was bad between' + str(scan_times[
+                start]) + '[index=' + str(start) + '] and ' + str(scan_times[end]) + '[index=' + str(end) + ']\n')
+
+        elif reason == BAD_ANTENNA_TIME:
+            self.measurement_set.flag_bad_antenna_time(self.flag_file,polarization, scan_id, element_id, bad_timerange,
+                                                       flagged_spw)
+            logger.debug('Antenna=' + str(element_id) + ' was bad between' + str(scan_times[
+                start]) + '[index=' + str(start) + '] and ' + str(scan_times[end]) + '[index=' + str(end) + ']\n')
+        else:
+            self.measurement_set.flag_bad_baseline_time(self.flag_file,polarization, scan_id, element_id,
+                                                        bad_timerange, flagged_spw)
+            logger.debug('Baseline=' + str(element_id) + ' was bad between' + str(scan_times[
+                start]) + '[index=' + str(start) + '] and ' + str(scan_times[end]) + '[index=' + str(end) + ']\n')
 
     def _print_polarization_details(self, global_sigma, global_median, polarization, scan_id):
         logger.info(
@@ -0,0 +1,73 @@
+import math
+import numpy
+
+
+class QuantileSketch:
+    # readings are counted in buckets growing geometrically by gamma, a quantile is the centre of the bucket holding
+    # that rank and so within relative_accuracy of the reading of that rank. The lowest buckets are merged beyond
+    # max_buckets, which bounds the memory whatever the number of readings and costs accuracy on the lowest quantiles
+    def __init__(self, relative_accuracy, max_buckets):
+        self.relative_accuracy = relative_accuracy
+        self._log_gamma = math.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        self._max_buckets = max_buckets
+        self._counts = numpy.zeros(0, dtype=numpy.int64)
+        self._offset = 0  # bucket index of _counts[0]
+        self._zero_count = 0  # amplitudes are never negative, readings at or below zero are counted at zero
+        self.count = 0
+
+    def add(self, readings):
+        readings_count, indices = self._bucket_indices(readings)
+        self.count += readings_count
+        self._zero_count += readings_count - indices.size
+        if not indices.size: return
+
+        low, high = indices.min(), indices.max()
+        if self._counts.size:
+            low, high = min(low, self._offset), max(high, self._offset + self._counts.size - 1)
+        low = max(low, high - self._max_buckets + 1)
+        counts = numpy.bincount(numpy.maximum(indices, low) - low, minlength=high - low + 1)
+        if self._counts.size:
+            kept = numpy.maximum(numpy.arange(self._offset, self._offset + self._counts.size), low) - low
+            numpy.add.at(counts, kept, self._counts)
+        self._counts, self._offset = counts, low
+
+    def remove(self, readings):
+        # takes readings added before out again, as when they are flagged
+        readings_count, indices = self._bucket_indices(readings)
+        self.count -= readings_count
+        self._zero_count -= readings_count - indices.size
+        numpy.subtract.at(self._counts, numpy.maximum(indices, self._offset) - self._offset, 1)
+
+    def _bucket_indices(self, readings):
+        # number of readings that are not NaN, and the buckets of those above zero
+        readings = numpy.asarray(readings, dtype=float).ravel()
+        readings = readings[numpy.isfinite(readings)]
+        return readings.size, numpy.ceil(numpy.log(readings[readings > 0]) / self._log_gamma).astype(numpy.int64)
+
+    def _bucket_values(self):
+        gamma = math.exp(self._log_gamma)
+        return 2 * numpy.power(gamma, numpy.arange(self._offset, self._offset + self._counts.size)) / (gamma + 1)
+
+    def _weighted_quantile(self, values, counts, q):
+        # interpolated between the readings of the neighbouring ranks, as numpy.nanmedian averages the middle two
+        order = numpy.argsort(values, kind='mergesort')
+        values, cumulative_counts = values[order], numpy.cumsum(counts[order])
+        rank = q * (self.count - 1)
+        lower, upper = values[numpy.searchsorted(cumulative_counts, [math.floor(rank), math.ceil(rank)], 'right')]
+        return lower + (rank - math.floor(rank)) * (upper - lower)
+
+    def quantile(self, q):
+        if not self.count: return numpy.nan
+        return self._weighted_quantile(numpy.append(0.0, self._bucket_values()),
+                                       numpy.append(self._zero_count, self._counts), q)
+
+    def median(self):
+        return self.quantile(0.5)
+
+    def mad(self):
+        # median of the deviations of the bucket centres from the sketched median. A reading x is off its bucket
+        # centre by at most relative_accuracy * x, so the error stays within relative_accuracy * (2 * median + mad)
+        if not self.count: return numpy.nan
+        median = self.median()
+        return self._weighted_quantile(numpy.abs(numpy.append(0.0, self._bucket_values()) - median),
+                                       numpy.append(self._zero_count, self._counts), 0.5)
@@ -0,0 +1,59 @@
+import numpy
+from numpy.lib.stride_tricks import as_strided
+
+
+class RollingStatistics:
+    MAD_TO_SIGMA = 1.4826
+
+    def __init__(self, matrix, window_config):
+        # matrix holds [group, reading, time] amplitudes, the readings of a group are windowed together
+        self._window_config = window_config
+        self.starts = self._window_starts(matrix.shape[-1])
+        self.ends = numpy.minimum(self.starts + window_config.window_size, matrix.shape[-1]) - 1
+        windows = self._windows(matrix)
+        # [group, window]
+        self.counts = numpy.isfinite(windows).sum(axis=-1)
+        self.medians = self._nanmedians(windows)
+        self.mads = self._nanmedians(numpy.abs(windows - self.medians[..., numpy.newaxis]))
+
+    def _window_starts(self, readings_count):
+        # as the sliding window did, windows step by window_size - overlap and the last one ends the collection,
+        # shorter than window_size when the collection does not divide evenly
+        window_size, overlap = self._window_config.window_size, self._window_config.overlap
+        starts = [0]
+        while starts[-1] + window_size < readings_count:
+            starts.append(starts[-1] + window_size - overlap)
+        return numpy.array(starts)
+
+    def _windows(self, matrix):
+        # [group, window, reading] over a strided view, padded with NaN to fill the last window
+        window_size = self._window_config.window_size
+        padded = numpy.full(matrix.shape[:-1] + (self.starts[-1] + window_size,), numpy.nan, dtype=matrix.dtype)
+        padded[..., :matrix.shape[-1]] = matrix
+        time_stride = padded.strides[-1]
+        windows = as_strided(padded, shape=padded.shape[:-1] + (len(self.starts), window_size),
+                             strides=padded.strides[:-1] + ((window_size - self._window_config.overlap) * time_stride,
+                                                            time_stride))
+        windows = windows.swapaxes(-3, -2)
+        return windows.reshape(windows.shape[:-2] + (-1,))
+
+    def _nanmedians(self, windows):
+        # as numpy.nanmedian of every window, NaN sorts after every reading
+        ordered = numpy.sort(windows, axis=-1).reshape(-1, windows.shape[-1])
+        counts = numpy.logical_not(numpy.isnan(ordered)).sum(axis=-1)
+        rows = numpy.arange(len(ordered))
+        medians = (ordered[rows, numpy.maximum(counts - 1, 0) // 2] + ordered[rows, counts // 2]) / 2
+        medians[counts == 0] = numpy.nan
+        return medians.reshape(windows.shape[:-1])
+
+    def mad_sigmas(self):
+        # in float64 as 1.4826 times the numpy scalar mad of a window
+        return RollingStatistics.MAD_TO_SIGMA * self.mads.astype(float)
+
+    def deviations(self, global_median, deviation_threshold):
+        # [group, window] deviated median and scattered amplitude of the windows with sufficient data
+        sufficient_data = self.counts > self._window_config.window_size - self._window_config.overlap
+        with numpy.errstate(invalid='ignore'):
+            deviated_median = numpy.abs(self.medians - global_median).astype(float) > deviation_threshold
+            scattered_amplitude = self.mad_sigmas() > deviation_threshold
+        return sufficient_data & deviated_median, sufficient_data & scattered_amplitude
@@ -0,0 +1,125 @@
+import numpy
+from scipy import stats
+
+from utilities.helpers import calculate_percentage
+
+
+class ClosurePhaseEngine:
+    TRIADS_PER_BATCH = 64
+    SAMPLING_SEED = 0  # sampled decisions are reproducible between runs
+
+    def __init__(self, visibility_data, antenna_ids, closure_threshold, percentage_of_closures):
+        self._antenna_ids = list(antenna_ids)
+        self._closure_threshold = closure_threshold
+        self._percentage_of_closures = percentage_of_closures
+        self._phases = self._phase_matrix(visibility_data)
+
+    def _phase_matrix(self, data):
+        # [antenna, antenna, time] phases, negated for the reversed orientation, NaN where flagged or missing
+        rows = data.baseline_rows_between(self._antenna_ids)
+        masked_phases = data.masked_data()
+        phases = numpy.full(rows.shape + (masked_phases.shape[1],), numpy.nan, dtype=masked_phases.dtype)
+        reversed_rows = rows.T
+        backward = reversed_rows >= 0
+        phases[backward] = -masked_phases[reversed_rows[backward]]
+        forward = rows >= 0
+        phases[forward] = masked_phases[rows[forward]]
+        return phases
+
+    def triplet_counts(self):
+        # every unique triad is evaluated once and counted for each of its three antennas
+        antenna_count = len(self._antenna_ids)
+        good_counts = numpy.zeros(antenna_count, dtype=int)
+        present_counts = numpy.zeros(antenna_count, dtype=int)
+        for first in range(antenna_count - 2):
+            second, third = numpy.triu_indices(antenna_count - first - 1, 1)
+            second += first + 1
+            third += first + 1
+            good, present = self._evaluate_triads(first, second, third)
+            good_counts[first] += numpy.count_nonzero(good)
+            present_counts[first] += numpy.count_nonzero(present)
+            for members in [second, third]:
+                numpy.add.at(good_counts, members, good.astype(int))
+                numpy.add.at(present_counts, members, present.astype(int))
+        evaluated_counts = numpy.full(antenna_count, (antenna_count - 1) * (antenna_count - 2) / 2, dtype=int)
+        return good_counts, present_counts, evaluated_counts
+
+    def settled_triplet_counts(self, percentage_of_good_triplets, confidence_level=None):
+        # triads of an antenna are evaluated in batches until its decision can no longer change, or with a
+        # confidence level, in random order until the sampled percentage is that far from the threshold
+        antenna_count = len(self._antenna_ids)
+        z_score = stats.norm.ppf(0.5 + confidence_level / 2.0) if confidence_level else None
+        random_state = numpy.random.RandomState(ClosurePhaseEngine.SAMPLING_SEED)
+        # results of triads evaluated for an earlier antenna, indexed by their sorted positions
+        evaluated = numpy.zeros((antenna_count,) * 3, dtype=bool)
+        good = numpy.zeros((antenna_count,) * 3, dtype=bool)
+        present = numpy.zeros((antenna_count,) * 3, dtype=bool)
+        good_counts = numpy.zeros(antenna_count, dtype=int)
+        present_counts = numpy.zeros(antenna_count, dtype=int)
+        evaluated_counts = numpy.zeros(antenna_count, dtype=int)
+
+        for position in range(antenna_count):
+            triads = self._triads_with(position)
+            if z_score is None:
+                triads = triads[:, numpy.argsort(numpy.logical_not(evaluated[tuple(triads)]), kind='mergesort')]
+            else:
+                triads = triads[:, random_state.permutation(triads.shape[1])]
+            for start in range(0, triads.shape[1], ClosurePhaseEngine.TRIADS_PER_BATCH):
+                batch = tuple(triads[:, start:start + ClosurePhaseEngine.TRIADS_PER_BATCH])
+                pending = numpy.logical_not(evaluated[batch])
+                if pending.any():
+                    pending_triads = tuple(members[pending] for members in batch)
+                    good[pending_triads], present[pending_triads] = self._evaluate_triads(*pending_triads)
+                    evaluated[pending_triads] = True
+                good_counts[position] += numpy.count_nonzero(good[batch])
+                present_counts[position] += numpy.count_nonzero(present[batch])
+                evaluated_counts[position] += len(batch[0])
+                if self._is_settled(good_counts[position], present_counts[position],
+                                    triads.shape[1] - evaluated_counts[position], percentage_of_good_triplets,
+                                    z_score):
+                    break
+        return good_counts, present_counts, evaluated_counts
+
+    def _triads_with(self, position):
+        # [3, triads] sorted positions of every triad containing the antenna at position
+        others = numpy.delete(numpy.arange(len(self._antenna_ids)), position)
+        second, third = numpy.triu_indices(len(others), 1)
+        return numpy.sort(numpy.array([numpy.full(len(second), position, dtype=int), others[second],
+                                       others[third]]), axis=0)
+
+    def _is_settled(self, good_count, present_count, remaining_count, percentage_of_good_triplets, z_score):
+        if remaining_count == 0: return True
+        lowest = calculate_percentage(good_count, present_count + remaining_count)
+        highest = max(calculate_percentage(good_count, present_count),
+                      calculate_percentage(good_count + remaining_count, present_count + remaining_count))
+        if lowest > percentage_of_good_triplets or highest <= percentage_of_good_triplets: return True
+        if z_score is None or present_count == 0: return False
+        lowest, highest = self._wilson_interval(good_count, present_count, remaining_count, z_score)
+        return lowest > percentage_of_good_triplets or highest <= percentage_of_good_triplets
+
+    def _wilson_interval(self, good_count, present_count, remaining_count, z_score):
+        fraction = float(good_count) / present_count
+        spread = z_score ** 2 / present_count
+        centre = (fraction + spread / 2) / (1 + spread)
+        half_width = z_score / (1 + spread) * numpy.sqrt(fraction * (1 - fraction) / present_count +
+                                                         spread / (4 * present_count))
+        # finite population correction, the triads of an antenna are sampled without replacement
+        half_width *= numpy.sqrt(float(remaining_count) / (present_count + remaining_count - 1))
+        # widened to hold the sampled percentage the antenna is decided on
+        return min(centre - half_width, fraction) * 100, max(centre + half_width, fraction) * 100
+
+    def _evaluate_triads(self, first, second, third):
+        closure_phases = self._rewrap(self._phases[first, second] + self._phases[second, third] +
+                                      self._phases[third, first])
+        readings = numpy.isfinite(closure_phases).sum(axis=1)
+        absolute_phases = numpy.abs(closure_phases)
+        # percentile of the threshold among the closure phases, as scipy percentileofscore with kind='rank'
+        with numpy.errstate(invalid='ignore'):
+            below = (absolute_phases < self._closure_threshold).sum(axis=1)
+            below_or_equal = (absolute_phases <= self._closure_threshold).sum(axis=1)
+        percentile = (below + below_or_equal + (below_or_equal > below)) * 50.0 / numpy.maximum(readings, 1)
+        present = readings > 0
+        return numpy.logical_and(present, percentile > self._percentage_of_closures), present
+
+    def _rewrap(self, phase):
+        return numpy.arctan2(numpy.sin(phase), numpy.cos(phase))
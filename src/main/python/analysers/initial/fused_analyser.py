@@ -0,0 +1,28 @@
+from analysers.analyser import Analyser
+from utilities.logger import logger
+from utilities.terminal_color import Color
+
+
+class FusedAnalyser(Analyser):
+    def __init__(self, measurement_set, source, analysers):
+        super(FusedAnalyser, self).__init__(measurement_set, source)
+        self._analysers = analysers
+
+    def _data_column(self):
+        return self._analysers[0]._data_column()
+
+    def _antenna_status_codes(self, spw, polarization, scan_id):
+        # every analyser runs on the scan before the next one is read, analysers on the same column share the read
+        logger.debug(Color.BACKGROUD_WHITE + "Polarization =" + polarization + " Scan Id=" + str(scan_id) + Color.ENDC)
+        visibility_data = {}
+        status_codes = []
+        for analyser in self._analysers:
+            data_column = analyser._data_column()
+            if data_column not in visibility_data:
+                visibility_data[data_column] = self._get_data(spw, polarization, scan_id, data_column)
+            status_codes.append(analyser.status_codes_for(visibility_data[data_column], polarization, scan_id))
+        return status_codes
+
+    def _update_antenna_states(self, polarization, scan_id, status_codes):
+        for analyser, analyser_status_codes in zip(self._analysers, status_codes):
+            analyser._update_antenna_states(polarization, scan_id, analyser_status_codes)
@@ -1,39 +1,52 @@
-import operator
-from models.antenna_status import AntennaStatus
+import numpy
+from models.phase_set import PhaseSet
 
 
 class RMatrix:
-    def __init__(self, spw, polarization, scan_id):
+    def __init__(self, visibility_data, antennas, polarization, scan_id):
         self.polarization = polarization
-        self.spw = spw
         self.scan_id = scan_id
-        self._r_matrix = {}
+        self._antennas = list(antennas)
+        self._positions = {antenna: position for position, antenna in enumerate(self._antennas)}
+        # [antenna, antenna] angular dispersion of every baseline, NaN where there is no baseline
+        self._r_matrix = self._angular_dispersions(visibility_data)
 
     def __repr__(self):
         return self.polarization + " " + str(self.scan_id) + str(self._r_matrix)
 
-    def add(self, antenna1, antenna2, r_value):
-        if antenna1 not in self._r_matrix.keys():
-            self._r_matrix[antenna1] = {}
-        self._r_matrix[antenna1].update({antenna2: r_value})
-
-    def get_any_antennas(self, base_antenna, min_doubtful_antennas):
-        sorted_r_matrix = sorted(self._r_matrix[base_antenna].items(), key=operator.itemgetter(1))
-        new_doubtful_antenna_tuples = set(sorted_r_matrix[:min_doubtful_antennas])
-        return map(lambda tuple: tuple[0], new_doubtful_antenna_tuples)
+    def _angular_dispersions(self, data):
+        antenna_ids = numpy.array([antenna.id for antenna in self._antennas], dtype=int)
+        rows = data.baseline_rows_between(antenna_ids)
+        # a baseline is read in the (lower id, higher id) orientation it is stored in
+        rows = numpy.where(antenna_ids[:, numpy.newaxis] < antenna_ids[numpy.newaxis, :], rows, rows.T)
+        numpy.fill_diagonal(rows, -1)
+        r_values = self._r_values(data.masked_data())
+        r_matrix = numpy.full(rows.shape, numpy.nan)
+        present = rows >= 0
+        r_matrix[present] = r_values[rows[present]]
+        return r_matrix
+
+    def _r_values(self, phases):
+        # |nanmean(exp(i phase))| of every baseline, from the mean sine and cosine as PhaseSet does
+        unflagged = numpy.isfinite(phases)
+        readings = unflagged.sum(axis=1)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            # means stay in the precision of the phases like nanmean, and are squared in float64
+            mean_sine = (numpy.where(unflagged, numpy.sin(phases), 0).sum(axis=1) / readings).astype(phases.dtype)
+            mean_cosine = (numpy.where(unflagged, numpy.cos(phases), 0).sum(axis=1) / readings).astype(phases.dtype)
+            r_values = numpy.sqrt(mean_sine.astype(float) ** 2 + mean_cosine.astype(float) ** 2)
+        r_values[readings == 0] = PhaseSet.INVALID_ANGULAR_DISPERSION
+        return r_values
+
+    def valid_baselines_count(self, base_antenna):
+        r_values = self._r_matrix[self._positions[base_antenna]]
+        return numpy.count_nonzero(numpy.isfinite(r_values) & (r_values != PhaseSet.INVALID_ANGULAR_DISPERSION))
 
     def get_doubtful_antennas(self, base_antenna, r_threshold, min_doubtful_antennas):
-        doubtful_antennas = set()
-        if base_antenna not in self._r_matrix: return doubtful_antennas
-        for antenna, r_value in self._r_matrix[base_antenna].iteritems():
-            if r_value < r_threshold:
-                doubtful_antennas.add(antenna)
-
-        if len(doubtful_antennas) < min_doubtful_antennas:
-            new_doubtful_antennas = self.get_any_antennas(base_antenna, min_doubtful_antennas)
-            doubtful_antennas = doubtful_antennas.union(new_doubtful_antennas)
-
-        for doubtful_antenna in doubtful_antennas:
-            doubtful_antenna.update_state(self.polarization, self.scan_id, AntennaStatus.DOUBTFUL)
-
-        return doubtful_antennas
+        r_values = self._r_matrix[self._positions[base_antenna]]
+        present = numpy.flatnonzero(numpy.isfinite(r_values))
+        doubtful = present[r_values[present] < r_threshold]
+        if len(doubtful) < min_doubtful_antennas:
+            lowest = present[numpy.argsort(r_values[present], kind='mergesort')[:min_doubtful_antennas]]
+            doubtful = numpy.union1d(doubtful, lowest)
+        return [self._antennas[position] for position in doubtful]
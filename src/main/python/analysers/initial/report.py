@@ -3,13 +3,11 @@ from utilities.logger import logger
 
 
 class Report:
-    def __init__(self, antennas):
-        self.__antennas = antennas
+    def __init__(self, antenna_states):
+        self.__antenna_states = antenna_states
 
     def generate_report(self, scan_ids):
         logger.info("AntennaId, Polarisation, ScanId, R_Status, CP_Status")
-        for ant in self.__antennas:
-            for state in ant.get_states():
-                if state.scan_id in scan_ids and (state.get_R_phase_status() == AntennaStatus.BAD and state.get_closure_phase_status() == AntennaStatus.BAD):
-                    logger.info("   {0}\t   \t{1}\t   {2}\t   {3}\t     {4}".format(
-                        ant.id, state.polarization, state.scan_id, state.get_R_phase_status(), state.get_closure_phase_status()))
\ No newline at end of file
+        for antenna_id, polarization, scan_id in self.__antenna_states.bad_states(scan_ids):
+            logger.info("   {0}\t   \t{1}\t   {2}\t   {3}\t     {4}".format(
+                antenna_id, polarization, scan_id, AntennaStatus.BAD, AntennaStatus.BAD))
\ No newline at end of file
@@ -0,0 +1,158 @@
+import cPickle
+import os
+import numpy
+
+from backends.backend import Backend
+from models.visibility_cache import cache_key
+from utilities.helpers import create_dir
+from utilities.logger import logger
+
+
+class BackendArchive:
+    INDEX_FILE = 'index.pkl'
+
+    def __init__(self, archive_path):
+        self._archive_path = archive_path
+        self._metadata = {}
+        self._data_files = {}
+
+    def load(self):
+        with open(os.path.join(self._archive_path, BackendArchive.INDEX_FILE), 'rb') as index_file:
+            self._metadata, self._data_files = cPickle.load(index_file)
+
+    def _save_index(self):
+        with open(os.path.join(self._archive_path, BackendArchive.INDEX_FILE), 'wb') as index_file:
+            cPickle.dump((self._metadata, self._data_files), index_file, cPickle.HIGHEST_PROTOCOL)
+
+    def record_metadata(self, key, response):
+        if key in self._metadata: return
+        self._metadata[key] = response
+        self._save_index()
+
+    def metadata(self, key):
+        if key not in self._metadata:
+            raise KeyError("No recorded response for {0} in {1}".format(key, self._archive_path))
+        return self._metadata[key]
+
+    def record_data(self, key, generation, data_items):
+        if generation in self._data_files.get(key, {}): return
+        file_name = "data_{0}.npz".format(sum(map(len, self._data_files.values())))
+        numpy.savez_compressed(os.path.join(self._archive_path, file_name), **data_items)
+        self._data_files.setdefault(key, {})[generation] = file_name
+        self._save_index()
+
+    def data(self, key, generation):
+        recorded_generations = [recorded for recorded in self._data_files.get(key, {}) if recorded <= generation]
+        if not recorded_generations:
+            raise KeyError("No recorded data for {0} in {1}".format(key, self._archive_path))
+        file_name = self._data_files[key][max(recorded_generations)]
+        with numpy.load(os.path.join(self._archive_path, file_name)) as data_items:
+            return dict(data_items.items())
+
+
+class RecordingBackend(Backend):
+    READS_IN_WORKERS = False  # the archive index is rewritten on every read
+
+    def __init__(self, backend, archive_path):
+        super(RecordingBackend, self).__init__(backend.dataset_path)
+        create_dir(archive_path)
+        logger.info("Recording data access of {0} to {1}".format(backend.dataset_path, archive_path))
+        self._backend = backend
+        self._archive = BackendArchive(archive_path)
+        self._generation = 0  # bumped on every change CASA makes to the dataset
+        backend.add_data_change_listener(self._next_generation)
+
+    def _next_generation(self, columns):
+        self._generation += 1
+
+    def add_data_change_listener(self, listener):
+        self._backend.add_data_change_listener(listener)
+
+    def _recorded(self, method, *args):
+        response = getattr(self._backend, method)(*args)
+        self._archive.record_metadata((method,) + args, response)
+        return response
+
+    def open(self):
+        self._backend.open()
+
+    def close(self):
+        self._backend.close()
+
+    def reopen(self):
+        self._backend.reopen()
+
+    def scan_numbers(self):
+        return self._recorded('scan_numbers')
+
+    def scans_for_field(self, field_id):
+        return self._recorded('scans_for_field', field_id)
+
+    def fields_for_spw(self, spw):
+        return self._recorded('fields_for_spw', spw)
+
+    def field_names(self):
+        return self._recorded('field_names')
+
+    def antennas_for_scan(self, scan_id):
+        return self._recorded('antennas_for_scan', scan_id)
+
+    def times_for_scan(self, scan_id):
+        return self._recorded('times_for_scan', scan_id)
+
+    def get_data(self, spw, channel, polarizations, filters, columns):
+        data_items = self._backend.get_data(spw, channel, polarizations, filters, columns)
+        self._archive.record_data(cache_key(spw, channel, tuple(polarizations), filters, columns),
+                                  self._generation, data_items)
+        return data_items
+
+    def flagdata(self, flag_file, reasons="any"):
+        self._backend.flagdata(flag_file, reasons)
+
+
+class ReplayBackend(Backend):
+    def __init__(self, dataset_path, archive_path, casa_runner):
+        super(ReplayBackend, self).__init__(dataset_path)
+        logger.info("Replaying data access of {0} from {1}".format(dataset_path, archive_path))
+        self._archive = BackendArchive(archive_path)
+        self._archive.load()
+        self._casa_runner = casa_runner
+        self._generation = 0
+        casa_runner.add_data_change_listener(self._next_generation)
+
+    def _next_generation(self, columns):
+        self._generation += 1
+
+    def add_data_change_listener(self, listener):
+        self._casa_runner.add_data_change_listener(listener)
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def scan_numbers(self):
+        return self._archive.metadata(('scan_numbers',))
+
+    def scans_for_field(self, field_id):
+        return self._archive.metadata(('scans_for_field', field_id))
+
+    def fields_for_spw(self, spw):
+        return self._archive.metadata(('fields_for_spw', spw))
+
+    def field_names(self):
+        return self._archive.metadata(('field_names',))
+
+    def antennas_for_scan(self, scan_id):
+        return self._archive.metadata(('antennas_for_scan', scan_id))
+
+    def times_for_scan(self, scan_id):
+        return self._archive.metadata(('times_for_scan', scan_id))
+
+    def get_data(self, spw, channel, polarizations, filters, columns):
+        return self._archive.data(cache_key(spw, channel, tuple(polarizations), filters, columns), self._generation)
+
+    def flagdata(self, flag_file, reasons="any"):
+        self._casa_runner.flagdata(flag_file, reasons)
+
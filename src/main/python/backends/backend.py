@@ -0,0 +1,62 @@
+class Backend(object):
+    TIME_INDEPENDENT_COLUMNS = ['antenna1', 'antenna2']
+    READS_IN_WORKERS = True  # whether forked worker processes may read through worker_copy
+
+    def __init__(self, dataset_path):
+        self.dataset_path = dataset_path
+        self._data_change_listeners = []
+
+    def add_data_change_listener(self, listener):
+        self._data_change_listeners.append(listener)
+
+    def _notify_data_change(self, columns=None):
+        for listener in self._data_change_listeners:
+            listener(columns)
+
+    def open(self):
+        raise NotImplementedError("Not implemented")
+
+    def close(self):
+        raise NotImplementedError("Not implemented")
+
+    def reopen(self):
+        self.close()
+        self.open()
+
+    def worker_copy(self):
+        return self  # the backend a forked worker process reads with
+
+    def metadata_fingerprint(self):
+        return None  # metadata is not persisted between runs unless the backend can tell when it changes
+
+    def scan_numbers(self):
+        raise NotImplementedError("Not implemented")
+
+    def scans_for_field(self, field_id):
+        raise NotImplementedError("Not implemented")
+
+    def fields_for_spw(self, spw):
+        raise NotImplementedError("Not implemented")
+
+    def field_names(self):
+        raise NotImplementedError("Not implemented")
+
+    def antennas_for_scan(self, scan_id):
+        raise NotImplementedError("Not implemented")
+
+    def times_for_scan(self, scan_id):
+        raise NotImplementedError("Not implemented")
+
+    def get_data(self, spw, channel, polarizations, filters, columns):
+        raise NotImplementedError("Not implemented")
+
+    def iter_data(self, spw, channel, polarizations, filters, columns, integrations_per_chunk):
+        # slices one full read, backends that can read a part of the scan at a time override this
+        data_items = self.get_data(spw, channel, polarizations, filters, columns)
+        for start in range(0, len(data_items['time']), integrations_per_chunk):
+            time_slice = slice(start, start + integrations_per_chunk)
+            yield dict((column, data if column in Backend.TIME_INDEPENDENT_COLUMNS else data[..., time_slice])
+                       for column, data in data_items.iteritems())
+
+    def flagdata(self, flag_file, reasons="any"):
+        raise NotImplementedError("Not implemented")
@@ -0,0 +1,97 @@
+import hashlib
+import os
+
+from backends.backend import Backend
+from casa.casa_runner import CasaRunner
+from utilities.helpers import table_fingerprint
+
+
+class CasacBackend(Backend):
+    METADATA_TABLES = ['ANTENNA', 'FIELD', 'OBSERVATION', 'SPECTRAL_WINDOW']
+    ITERATION_INTERVAL = 1.0e9  # seconds, longer than any scan so that only maxrows splits the iteration
+
+    def __init__(self, dataset_path, casa_runner):
+        super(CasacBackend, self).__init__(dataset_path)
+        import casac  # only importable from the python bundled with CASA
+        self._casac = casac.casac
+        self._casa_runner = casa_runner
+        self._handles = casa_runner.dataset_handles
+        self._allow_logs_above_warning_level()
+
+    def _allow_logs_above_warning_level(self):
+        sink = self._casac.logsink()
+        sink.showconsole(True)
+        sink.setglobal(True)
+        sink.filter('WARN')
+
+    def add_data_change_listener(self, listener):
+        self._casa_runner.add_data_change_listener(listener)
+
+    def open(self):
+        pass  # the handle is opened on the first read
+
+    def close(self):
+        self._handles.release()
+
+    def reopen(self):
+        self._handles.release()
+
+    def worker_copy(self):
+        # casac tools are not safe to share with a forked process, the worker opens the dataset itself
+        return CasacBackend(self.dataset_path, CasaRunner(self.dataset_path, self._casa_runner.get_output_path()))
+
+    def metadata_fingerprint(self):
+        if not os.path.isdir(self.dataset_path): return None
+        # flagging and calibration rewrite the main table in place, its files only grow or shrink with its rows
+        table_states = [table_fingerprint(self.dataset_path, with_mtime=False)]
+        for table_name in CasacBackend.METADATA_TABLES:
+            table_path = os.path.join(self.dataset_path, table_name)
+            if os.path.isdir(table_path): table_states.append(table_fingerprint(table_path))
+        return hashlib.sha1(''.join(table_states)).hexdigest()
+
+    def scan_numbers(self):
+        return self._handles.ms().metadata().scannumbers()
+
+    def scans_for_field(self, field_id):
+        return self._handles.ms().metadata().scansforfield(field_id)
+
+    def fields_for_spw(self, spw):
+        return self._handles.ms().metadata().fieldsforspw(spw)
+
+    def field_names(self):
+        return self._handles.ms().metadata().fieldnames()
+
+    def antennas_for_scan(self, scan_id):
+        return self._handles.ms().metadata().antennasforscan(scan_id)
+
+    def times_for_scan(self, scan_id):
+        return self._handles.ms().metadata().timesforscan(scan_id)
+
+    def _select(self, spw, channel, polarizations, filters):
+        ms = self._handles.ms()
+        ms.selectinit(reset=True)
+        ms.msselect({"spw": spw})
+        ms.selectpolarization(polarizations)
+        ms.selectchannel(**channel)
+        if filters: ms.select(filters)
+        return ms
+
+    def get_data(self, spw, channel, polarizations, filters, columns):
+        ifraxis = True  # This will always inserts a default value for the missing rows
+        return self._select(spw, channel, polarizations, filters).getdata(columns, ifraxis=ifraxis)
+
+    def iter_data(self, spw, channel, polarizations, filters, columns, integrations_per_chunk):
+        ms = self._select(spw, channel, polarizations, filters)
+        rows_per_integration = ms.metadata().nbaselines(True)
+        ms.iterinit(columns=['TIME'], interval=CasacBackend.ITERATION_INTERVAL,
+                    maxrows=integrations_per_chunk * rows_per_integration)
+        ms.iterorigin()
+        try:
+            while True:
+                yield ms.getdata(columns, ifraxis=True)
+                if not ms.iternext(): break
+        finally:
+            ms.iterend()
+
+    def flagdata(self, flag_file, reasons="any"):
+        self._casa_runner.flagdata(flag_file, reasons)
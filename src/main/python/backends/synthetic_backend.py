@@ -0,0 +1,171 @@
+import os
+import re
+import numpy
+from collections import namedtuple
+from datetime import datetime
+
+from backends.backend import Backend
+
+RfiBurst = namedtuple('RfiBurst', 'scan_id, start, length, strength')
+
+
+class SyntheticBackend(Backend):
+    MJD_EPOCH = datetime(1858, 11, 17)
+    TIME_FORMAT = '%Y/%m/%d/%H:%M:%S'
+    FLAG_ENTRY_PATTERN = re.compile(r"(\w+)='([^']*)'")
+    SCAN_GAP = 60.0
+
+    def __init__(self, dataset_path='synthetic.ms', antenna_count=30, scans_for_fields=None, field_names=None,
+                 integrations_per_scan=60, integration_time=8.0, start_time=4.9e9, polarizations=('RR', 'LL'),
+                 spws=('0',), amplitude=1.0, noise=0.1, bad_antennas=None, rfi_bursts=(), seed=0):
+        super(SyntheticBackend, self).__init__(dataset_path)
+        self._antenna_ids = numpy.arange(antenna_count)
+        self._scans_for_fields = scans_for_fields or {0: [1], 1: [2, 4], 2: [3]}
+        self._field_names = field_names or ["FIELD_{0}".format(field_id) for field_id in
+                                            range(max(self._scans_for_fields) + 1)]
+        self._integrations_per_scan = integrations_per_scan
+        self._integration_time = integration_time
+        self._start_time = start_time
+        self._polarizations = list(polarizations)
+        self._spws = list(spws)
+        self._amplitude = amplitude
+        self._noise = noise
+        self._bad_antennas = bad_antennas or {}  # antenna id -> bad scan ids (None for every scan)
+        self._rfi_bursts = rfi_bursts
+        self._seed = seed
+        self._antenna1, self._antenna2 = numpy.triu_indices(antenna_count, 1)
+        self._visibilities = {}
+        self._flags = {}
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def scan_numbers(self):
+        return numpy.array(sorted(sum(self._scans_for_fields.values(), [])))
+
+    def scans_for_field(self, field_id):
+        return numpy.array(sorted(self._scans_for_fields.get(field_id, [])))
+
+    def fields_for_spw(self, spw):
+        return numpy.array(sorted(self._scans_for_fields))
+
+    def field_names(self):
+        return self._field_names
+
+    def antennas_for_scan(self, scan_id):
+        return self._antenna_ids.copy()
+
+    def times_for_scan(self, scan_id):
+        scan_index = list(self.scan_numbers()).index(scan_id)
+        scan_duration = self._integrations_per_scan * self._integration_time + SyntheticBackend.SCAN_GAP
+        scan_start = self._start_time + scan_index * scan_duration
+        return scan_start + numpy.arange(self._integrations_per_scan) * self._integration_time
+
+    def _parse_time(self, formatted_time):
+        return (datetime.strptime(formatted_time, SyntheticBackend.TIME_FORMAT) -
+                SyntheticBackend.MJD_EPOCH).total_seconds()
+
+    def get_data(self, spw, channel, polarizations, filters, columns):
+        scan_id = filters['scan_number']
+        data, corrected_data = self._scan_visibilities(spw, scan_id)
+        polarization_indices = [self._polarizations.index(polarization) for polarization in polarizations]
+        noise_scale = 1.0 / numpy.sqrt(channel.get('width', 1))  # averaging channels lowers the noise
+        items = {'antenna1': self._antenna1.copy(), 'antenna2': self._antenna2.copy(),
+                 'time': self.times_for_scan(scan_id),
+                 'flag': self._scan_flags(spw, scan_id)[polarization_indices][:, numpy.newaxis].copy(),
+                 'data': self._with_noise(data, noise_scale)[polarization_indices][:, numpy.newaxis],
+                 'corrected_data': self._with_noise(corrected_data, noise_scale)[polarization_indices][:,
+                                   numpy.newaxis]}
+        return dict((column, items[column]) for column in columns)
+
+    def _with_noise(self, visibilities, noise_scale):
+        signal, noise = visibilities
+        return signal + noise * noise_scale
+
+    def _scan_flags(self, spw, scan_id):
+        if (spw, scan_id) not in self._flags:
+            self._flags[(spw, scan_id)] = numpy.zeros(
+                (len(self._polarizations), len(self._antenna1), self._integrations_per_scan), dtype=bool)
+        return self._flags[(spw, scan_id)]
+
+    def _scan_visibilities(self, spw, scan_id):
+        if (spw, scan_id) not in self._visibilities:
+            self._visibilities[(spw, scan_id)] = self._generate_visibilities(spw, scan_id)
+        return self._visibilities[(spw, scan_id)]
+
+    def _generate_visibilities(self, spw, scan_id):
+        random = numpy.random.RandomState(self._seed * 10007 + scan_id * 101 + int(spw))
+        shape = (len(self._polarizations), len(self._antenna1), self._integrations_per_scan)
+        antenna_count = len(self._antenna_ids)
+
+        phase_offsets = random.uniform(-numpy.pi, numpy.pi, (antenna_count, 1))
+        phase_drifts = numpy.cumsum(random.normal(0, 0.02, (antenna_count, self._integrations_per_scan)), axis=1)
+        antenna_phases = phase_offsets + phase_drifts
+        antenna_gains = numpy.ones((antenna_count, self._integrations_per_scan))
+        solved_phases = antenna_phases.copy()
+        baseline_phases = antenna_phases[self._antenna1] - antenna_phases[self._antenna2]
+
+        for antenna_id, bad_scan_ids in self._bad_antennas.iteritems():
+            if bad_scan_ids is None or scan_id in bad_scan_ids:
+                # baseline based corruption, so that closure phases of the antenna are affected as well
+                bad_rows = numpy.logical_or(self._antenna1 == antenna_id, self._antenna2 == antenna_id)
+                baseline_phases[bad_rows] = random.uniform(-numpy.pi, numpy.pi,
+                                                           (bad_rows.sum(), self._integrations_per_scan))
+                antenna_gains[antenna_id] = random.uniform(0.2, 3.0, self._integrations_per_scan)
+                solved_phases[antenna_id] = 0
+
+        baseline_gains = antenna_gains[self._antenna1] * antenna_gains[self._antenna2]
+        signal = numpy.empty(shape, dtype=numpy.complex128)
+        signal[:] = self._amplitude * baseline_gains * numpy.exp(1j * baseline_phases)
+
+        for burst in self._rfi_bursts:
+            if burst.scan_id == scan_id:
+                burst_slice = slice(burst.start, burst.start + burst.length)
+                signal[:, :, burst_slice] += burst.strength * numpy.exp(
+                    1j * random.uniform(-numpy.pi, numpy.pi, signal[:, :, burst_slice].shape))
+
+        noise = self._noise * (random.normal(size=shape) + 1j * random.normal(size=shape)) / numpy.sqrt(2)
+        calibration = numpy.exp(-1j * (solved_phases[self._antenna1] - solved_phases[self._antenna2]))
+        return (signal, noise), (signal * calibration, noise)
+
+    def flagdata(self, flag_file, reasons="any"):
+        entries = []
+        if os.path.exists(flag_file):
+            with open(flag_file) as flags:
+                entries = [dict(SyntheticBackend.FLAG_ENTRY_PATTERN.findall(line)) for line in flags]
+        for entry in entries:
+            if reasons == "any" or entry.get('reason') in reasons.split(','):
+                self._apply_flag_entry(entry)
+        self._notify_data_change()
+
+    def _apply_flag_entry(self, entry):
+        scan_ids = map(int, entry['scan'].split(',')) if 'scan' in entry else self.scan_numbers()
+        polarizations = entry['correlation'].split(',') if 'correlation' in entry else self._polarizations
+        polarization_indices = [self._polarizations.index(polarization) for polarization in polarizations]
+        spws = entry['spw'].split(',') if 'spw' in entry else self._spws
+        rows = self._rows_for(entry.get('antenna'))
+
+        for (spw, scan_id), flags in self._flags_for(spws, scan_ids):
+            times = numpy.round(self.times_for_scan(scan_id))
+            if 'timerange' in entry:
+                start, end = map(self._parse_time, entry['timerange'].split('~'))
+                time_mask = numpy.logical_and(times >= start, times <= end)
+            else:
+                time_mask = numpy.ones(times.shape, dtype=bool)
+            for polarization_index in polarization_indices:
+                flags[polarization_index][numpy.ix_(rows, time_mask)] = True
+
+    def _flags_for(self, spws, scan_ids):
+        return [((spw, scan_id), self._scan_flags(spw, scan_id)) for spw in spws for scan_id in scan_ids]
+
+    def _rows_for(self, antenna_selection):
+        if not antenna_selection:
+            return numpy.ones(self._antenna1.shape, dtype=bool)
+        if '&' in antenna_selection:
+            antenna1, antenna2 = sorted(map(int, antenna_selection.split('&')))
+            return numpy.logical_and(self._antenna1 == antenna1, self._antenna2 == antenna2)
+        antenna_ids = map(int, antenna_selection.split(','))
+        return numpy.logical_or(numpy.in1d(self._antenna1, antenna_ids), numpy.in1d(self._antenna2, antenna_ids))
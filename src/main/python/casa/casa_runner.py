@@ -3,19 +3,45 @@ from casa.flag_reasons import BAD_ANTENNA_TIME, BAD_BASELINE_TIME
 import os
 import platform
 import subprocess
-import casac
 from utilities.logger import logger
 from utilities.terminal_color import Color
 from utilities.helpers import format_spw_with_channels, create_dir
 from watchdog.observers import Observer
 from utilities.log_event_handler import LogEventHandler
 from models.calib_params import CalibParams
+from casa.dataset_handles import DatasetHandles
 
 
 class CasaRunner:
+    ALL_COLUMNS = None
+    CORRECTED_COLUMNS = ['corrected_data']
+
     def __init__(self, dataset_path, output_path):
         self._output_path = output_path
         self._dataset_path = dataset_path
+        self._data_change_listeners = []
+        self.dataset_handles = DatasetHandles(dataset_path)
+
+    def get_output_path(self):
+        return self._output_path
+
+    def add_data_change_listener(self, listener):
+        self._data_change_listeners.append(listener)
+
+    def _notify_data_change(self, columns):
+        for listener in self._data_change_listeners:
+            listener(columns)
+
+    def _changes_dataset(columns):
+        def changes_dataset_decorator(func):
+            def wrapper(self, *args, **kwargs):
+                result = func(self, *args, **kwargs)
+                self._notify_data_change(columns)
+                return result
+
+            return wrapper
+
+        return changes_dataset_decorator
 
     def _observe_imaging_logs(func):
         def wrapper(*args, **kwargs):
@@ -28,12 +54,14 @@ class CasaRunner:
 
         return wrapper
 
+    @_changes_dataset(ALL_COLUMNS)
     def flagdata(self, flag_file, reasons="any"):
         logger.info(Color.HEADER + "Flagging " + reasons + " reasons" + Color.ENDC)
         script_path = 'casa_scripts/flag.py'
         script_parameters = "{0} {1} {2}".format(self._dataset_path, flag_file, reasons)
         self._run(script_path, script_parameters)
 
+    @_changes_dataset(ALL_COLUMNS)
     def quack(self):
         logger.info(Color.HEADER + "Running quack..." + Color.ENDC)
         script_path = 'casa_scripts/quack.py'
@@ -52,7 +80,8 @@ class CasaRunner:
                                                                  flagging_type, scans, source_type)
             self._run(script_path, script_parameters)
 
-    def apply_flux_calibration(self, source_config, run_count):
+    @_changes_dataset(CORRECTED_COLUMNS)
+    def apply_flux_calibration(self, source_config, run_count, scan_ids=None):
         logger_message = "Applying Flux Calibration"
         if run_count > 1: logger_message += " with bandpass"
         calib_params = CalibParams(*config.CALIBRATION_CONFIGS['flux_calibrator']['calib_params'])
@@ -64,6 +93,7 @@ class CasaRunner:
         script_parameters = "{0} {1} {2} {3} {4} {5} {6}".format(run_count, self._dataset_path,
                                                                  self._output_path,
                                                                  fields, refant, spw, calib_params.minsnr)
+        if scan_ids: script_parameters += " " + ",".join(map(str, scan_ids))  # solutions are applied to these only
         self._run(script_path, script_parameters)
 
     def apply_bandpass_calibration(self, source_config):
@@ -77,8 +107,9 @@ class CasaRunner:
                                                                  source_config['bpcal_solint'],
                                                                  phase_calib_params.minsnr, phase_calib_params.solint)
 
-        self._run(script_path, script_parameters)
+        self._run(script_path, script_parameters, writes_dataset=False)
 
+    @_changes_dataset(CORRECTED_COLUMNS)
     def apply_phase_calibration(self, flux_cal_field, source_config):
         calib_params = CalibParams(*source_config['calib_params'])
         logger.info(Color.HEADER + "Applying Phase Calibration..." + Color.ENDC)
@@ -92,6 +123,7 @@ class CasaRunner:
                                                                      calib_params.solint)
         self._run(script_path, script_parameters)
 
+    @_changes_dataset(CORRECTED_COLUMNS)
     def apply_target_source_calibration(self, source_id):
         logger.info(Color.HEADER + "Applying Calibration to Target Source..." + Color.ENDC)
         flux_cal_fields = ",".join(map(str, config.GLOBAL_CONFIGS['flux_cal_fields']))
@@ -102,6 +134,7 @@ class CasaRunner:
                                                          source_id)
         self._run(script_path, script_parameters)
 
+    @_changes_dataset(ALL_COLUMNS)
     def r_flag(self, source_type, source_ids):
         script_path = 'casa_scripts/r_flag.py'
         source_ids = ','.join([str(source_id) for source_id in source_ids])
@@ -111,6 +144,7 @@ class CasaRunner:
         logger.info(Color.HEADER + "Running Rflag auto-flagging algorithm" + Color.ENDC)
         self._run(script_path, script_parameters)
 
+    @_changes_dataset(ALL_COLUMNS)
     def tfcrop(self, source_type, source_ids):
         script_path = 'casa_scripts/tfcrop.py'
         source_ids = ','.join([str(source_id) for source_id in source_ids])
@@ -143,7 +177,7 @@ class CasaRunner:
 
         script_parameters = "{0} {1} {2} {3} {4} {5}".format(self._dataset_path, output_path, field,
                                                              filters['datacolumn'], width, spw)
-        self._run(script_path, script_parameters)
+        self._run(script_path, script_parameters, writes_dataset=False)
 
     @_observe_imaging_logs
     def base_image(self):
@@ -152,6 +186,7 @@ class CasaRunner:
         script_parameters = "{0} {1} {2}".format(self._dataset_path, self._output_path, config.CONFIG_PATH)
         self._run(script_path, script_parameters)
 
+    @_changes_dataset(ALL_COLUMNS)
     @_observe_imaging_logs
     def apply_self_calibration(self, selfcal_config, calibration_mode, output_ms_path, output_path, spw):
         logger.info(Color.HEADER + "Applying self calibration for {0}".format(self._dataset_path) + Color.ENDC)
@@ -188,6 +223,7 @@ class CasaRunner:
 
         self._run(script_path, script_parameters)
 
+    @_changes_dataset(CORRECTED_COLUMNS)
     def apply_line_calibration(self, calmode_config, parent_source_id, mode):
         logger.info(Color.HEADER + "Applying calibration on Line.." + Color.ENDC)
         script_path = 'casa_scripts/apply_line_calibration.py'
@@ -209,6 +245,7 @@ class CasaRunner:
         if os.path.exists(flag_file):
             self.flagdata(flag_file, flag_reasons)
 
+    @_changes_dataset(CORRECTED_COLUMNS)
     def create_line_image(self, calmode_config, parent_source_id):
         logger.info(Color.HEADER + "Creating line image at {0}".format(self._output_path) + Color.ENDC)
         script_path = 'casa_scripts/create_line_image.py'
@@ -235,11 +272,6 @@ class CasaRunner:
                                                                                   parent_source_id,
                                                                                   ap_loop_count)
 
-    def _unlock_dataset(self):
-        table = casac.casac.table()
-        table.open(self._dataset_path)
-        table.unlock()
-
     def _form_casa_command(self, script, script_parameters):
         casa_path = config.CASA_CONFIGS['casa'][platform.system()]['path']
         logfile = config.OUTPUT_PATH + "/casa.log"
@@ -261,11 +293,14 @@ class CasaRunner:
         casa_command = self._form_casa_command(script, script_parameters)
         return mpi_command + casa_command
 
-    def _run(self, script, script_parameters=None):
+    def _run(self, script, script_parameters=None, writes_dataset=True):
         casa_output_file = config.OUTPUT_PATH + "/casa_output.txt"
 
         if not script_parameters: script_parameters = self._dataset_path
-        self._unlock_dataset()
+        if config.PIPELINE_CONFIGS['data_source']['mode'] == 'replay':
+            logger.debug("Replaying recorded data, skipped CASA script -> " + script)
+            return None
+        if writes_dataset: self.dataset_handles.release()
 
         if config.CASA_CONFIGS['is_parallel']:
             command = self._form_mpi_command(script, script_parameters)
@@ -0,0 +1,46 @@
+import time
+
+from utilities.logger import logger
+
+
+class DatasetHandles:
+    def __init__(self, dataset_path):
+        self._dataset_path = dataset_path
+        self._ms = None
+        self._release_listeners = []
+        self.opens = 0
+        self.releases = 0
+        self.lock_wait_seconds = 0.0
+
+    def ms(self):
+        # opened lazily, so a writer that took the locks in between is followed by exactly one reopen
+        if self._ms is None:
+            import casac  # only importable from the python bundled with CASA
+            start_time = time.time()
+            ms = casac.casac.ms()
+            ms.open(self._dataset_path)
+            self._waited_since(start_time)
+            self._ms = ms
+            self.opens += 1
+        return self._ms
+
+    def add_release_listener(self, listener):
+        self._release_listeners.append(listener)  # other readers of the dataset that have to let go as well
+
+    def release(self):
+        for listener in self._release_listeners:
+            listener()
+        if self._ms is None: return
+        start_time = time.time()
+        self._ms.close()
+        self._waited_since(start_time)
+        self._ms = None
+        self.releases += 1
+        logger.debug("Released locks on {0}".format(self._dataset_path))
+
+    def _waited_since(self, start_time):
+        self.lock_wait_seconds += time.time() - start_time
+
+    def __repr__(self):
+        return "DatasetHandles(opens={0}, releases={1}, lock_wait={2:.2f}s)".format(self.opens, self.releases,
+                                                                                   self.lock_wait_seconds)
@@ -1,26 +1,21 @@
+from models.antenna_state import AntennaState
+
+
 class Antenna:
-    def __init__(self, antenna_id):
+    def __init__(self, antenna_id, state_store):
         self.id = antenna_id
-        self.__antenna_states = []
-
-    def add_state(self, antenna_state):
-        self.__antenna_states.append(antenna_state)
+        self.__state_store = state_store
 
     def get_states(self, scan_ids=None):
-        if scan_ids:
-            return filter(lambda state: state.scan_id in scan_ids, self.__antenna_states)
-        return self.__antenna_states
+        scan_ids = scan_ids or self.__state_store.scan_ids
+        return [AntennaState(self.id, polarization, scan_id, self.__state_store) for polarization in
+                self.__state_store.polarizations for scan_id in self.__state_store.scan_ids if scan_id in scan_ids]
 
     def get_state_for(self, polarization, scan_id):
-        def state_filter(state):
-            return state.polarization == polarization and state.scan_id == scan_id
-
-        filtered_states = filter(state_filter, self.__antenna_states)
-        return filtered_states[0]
+        return AntennaState(self.id, polarization, scan_id, self.__state_store)
 
     def update_state(self, polarization, scan_id, status):
-        current_state = self.get_state_for(polarization, scan_id)
-        current_state.update_R_phase_status(status)
+        self.__state_store.update_r_phase_status(polarization, scan_id, self.id, status)
 
     def __repr__(self):
         return "A" + str(self.id)
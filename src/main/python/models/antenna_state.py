@@ -1,37 +1,24 @@
-from antenna_status import AntennaStatus
-
 class AntennaState:
-    def __init__(self, antenna_id, polarization, scan_id):
+    def __init__(self, antenna_id, polarization, scan_id, state_store):
         self.antenna = antenna_id
         self.scan_id = scan_id
         self.polarization = polarization
-        self.__closure_phase_status = None
-        self.__R_phase_status = None
+        self.__state_store = state_store
 
     def update_closure_phase_status(self, status):
-        if self._can_update_status(self.__closure_phase_status, status):
-            self.__closure_phase_status = status
-            return True
-        return False
+        return self.__state_store.update_closure_phase_status(self.polarization, self.scan_id, self.antenna, status)
 
     def is_bad(self):
-        return self.__R_phase_status == AntennaStatus.BAD and \
-               self.__closure_phase_status == AntennaStatus.BAD
+        return self.__state_store.is_bad(self.polarization, self.scan_id, self.antenna)
 
     def get_closure_phase_status(self):
-        return self.__closure_phase_status
+        return self.__state_store.closure_phase_status(self.polarization, self.scan_id, self.antenna)
 
     def update_R_phase_status(self, status):
-        if self._can_update_status(self.__R_phase_status, status):
-            self.__R_phase_status = status
-            return True
-        return False
-
-    def _can_update_status(self, current_status, new_status):
-        return (new_status in AntennaStatus.ALL) and (current_status in [None, AntennaStatus.DOUBTFUL])
+        return self.__state_store.update_r_phase_status(self.polarization, self.scan_id, self.antenna, status)
 
     def get_R_phase_status(self):
-        return self.__R_phase_status
+        return self.__state_store.r_phase_status(self.polarization, self.scan_id, self.antenna)
 
     def __repr__(self):
-        return str(self.antenna) + "" + str(self.scan_id) + str(self.polarization)
\ No newline at end of file
+        return str(self.antenna) + "" + str(self.scan_id) + str(self.polarization)
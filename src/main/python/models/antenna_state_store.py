@@ -0,0 +1,87 @@
+import numpy
+
+from models.antenna_status import AntennaStatus
+
+
+class AntennaStateStore:
+    STATUSES = [None] + AntennaStatus.ALL  # position in this list is the status code kept in the arrays
+    UPDATABLE_CODES = [STATUSES.index(None), STATUSES.index(AntennaStatus.DOUBTFUL)]
+    BAD_CODE = STATUSES.index(AntennaStatus.BAD)
+
+    def __init__(self, polarizations, scan_ids, antenna_ids):
+        self.polarizations = list(polarizations)
+        self.scan_ids = list(scan_ids)
+        self.antenna_ids = numpy.array(antenna_ids, dtype=int)
+        self._polarization_index = {polarization: index for index, polarization in enumerate(self.polarizations)}
+        self._scan_index = {scan_id: index for index, scan_id in enumerate(self.scan_ids)}
+        self._antenna_index = {antenna_id: index for index, antenna_id in enumerate(antenna_ids)}
+        # [polarization, scan, antenna]
+        shape = (len(self.polarizations), len(self.scan_ids), len(self.antenna_ids))
+        self._r_phase_status = numpy.zeros(shape, dtype=numpy.int8)
+        self._closure_phase_status = numpy.zeros(shape, dtype=numpy.int8)
+        self._flagged = numpy.zeros(shape, dtype=bool)
+
+    def _index(self, polarization, scan_id, antenna_id):
+        return self._polarization_index[polarization], self._scan_index[scan_id], self._antenna_index[antenna_id]
+
+    def _scan_indices(self, scan_ids):
+        return [self._scan_index[scan_id] for scan_id in scan_ids]
+
+    def _update_status(self, statuses, index, status):
+        if status in AntennaStatus.ALL and statuses[index] in AntennaStateStore.UPDATABLE_CODES:
+            statuses[index] = AntennaStateStore.STATUSES.index(status)
+            return True
+        return False
+
+    def update_r_phase_status(self, polarization, scan_id, antenna_id, status):
+        return self._update_status(self._r_phase_status, self._index(polarization, scan_id, antenna_id), status)
+
+    def update_closure_phase_status(self, polarization, scan_id, antenna_id, status):
+        return self._update_status(self._closure_phase_status, self._index(polarization, scan_id, antenna_id),
+                                   status)
+
+    def r_phase_status(self, polarization, scan_id, antenna_id):
+        return AntennaStateStore.STATUSES[self._r_phase_status[self._index(polarization, scan_id, antenna_id)]]
+
+    def closure_phase_status(self, polarization, scan_id, antenna_id):
+        return AntennaStateStore.STATUSES[self._closure_phase_status[self._index(polarization, scan_id, antenna_id)]]
+
+    def is_bad(self, polarization, scan_id, antenna_id):
+        index = self._index(polarization, scan_id, antenna_id)
+        return self._r_phase_status[index] == self._closure_phase_status[index] == AntennaStateStore.BAD_CODE
+
+    def bad_states(self, scan_ids):
+        # (antenna id, polarization, scan id) of every state bad on both R phase and closure phase,
+        # ordered by antenna, then polarization, then scan
+        bad = numpy.logical_and(self._r_phase_status == AntennaStateStore.BAD_CODE,
+                                self._closure_phase_status == AntennaStateStore.BAD_CODE)
+        in_scans = numpy.zeros(len(self.scan_ids), dtype=bool)
+        in_scans[self._scan_indices(filter(lambda scan_id: scan_id in self._scan_index, scan_ids))] = True
+        bad &= in_scans[numpy.newaxis, :, numpy.newaxis]
+        return [(int(self.antenna_ids[antenna]), self.polarizations[polarization], self.scan_ids[scan]) for
+                antenna, polarization, scan in numpy.argwhere(bad.transpose(2, 0, 1))]
+
+    def flag(self, polarizations, scan_ids, antenna_ids):
+        polarization_indices = [self._polarization_index[polarization] for polarization in polarizations]
+        antenna_indices = [self._antenna_index[antenna_id] for antenna_id in antenna_ids]
+        self._flagged[numpy.ix_(polarization_indices, self._scan_indices(scan_ids), antenna_indices)] = True
+
+    def unflagged_antenna_mask(self, polarization, scan_id):
+        return numpy.logical_not(self._flagged[self._polarization_index[polarization], self._scan_index[scan_id]])
+
+    def is_completely_flagged(self, polarization, scan_id):
+        return self._flagged[self._polarization_index[polarization], self._scan_index[scan_id]].all()
+
+    def completely_flagged_antenna_ids(self, polarization):
+        return self.antenna_ids[self._flagged[self._polarization_index[polarization]].all(axis=0)].tolist()
+
+    def antenna_ids_flagged_in_all(self, polarization, scan_ids):
+        if not scan_ids: return []
+        flagged = self._flagged[self._polarization_index[polarization]][self._scan_indices(scan_ids)]
+        return self.antenna_ids[flagged.all(axis=0)].tolist()
+
+    def flagged_scan_ids_by_antenna(self, polarization, scan_ids):
+        flagged = self._flagged[self._polarization_index[polarization]][self._scan_indices(scan_ids)]
+        scan_ids = numpy.array(scan_ids, dtype=int)
+        return {int(self.antenna_ids[antenna]): scan_ids[flagged[:, antenna]].tolist() for antenna in
+                numpy.flatnonzero(flagged.any(axis=0))}
@@ -1,42 +1,104 @@
-import casac
 import itertools
 import numpy
-from datetime import datetime, timedelta
-from itertools import product
+import os
 
+from backends.archive_backend import RecordingBackend, ReplayBackend
+from backends.casac_backend import CasacBackend
 from casa.casa_runner import CasaRunner
 from casa.flag_reasons import BAD_ANTENNA, BAD_ANTENNA_TIME, BAD_BASELINE_TIME, BAD_TIME
 from casa.flag_recorder import FlagRecorder
 from configs import config
 from models.antenna import Antenna
-from models.antenna_state import AntennaState
+from models.antenna_state_store import AntennaStateStore
 from models.baseline import Baseline
+from models.metadata_snapshot import MetadataSnapshot
+from models.persistent_scan_cache import PersistentScanCache
 from models.phase_set import PhaseSet
+from models.visibility_cache import VisibilityCache, cache_key
 from models.visibility_data import VisibilityData
+from models.visibility_prefetcher import VisibilityPrefetcher
+from utilities.helpers import create_dir, casa_timestamps
+from utilities.logger import logger
 
 
 class MeasurementSet:
-    def __init__(self, dataset_path, output_path):
+    def __init__(self, dataset_path, output_path, backend=None):
         self._dataset_path = dataset_path
         self.output_path = output_path
         self.casa_runner = CasaRunner(dataset_path, output_path)
         self.flag_recorder = FlagRecorder()
-        self._casac = casac.casac
-        self._allow_logs_above_warning_level()
-        self._ms = self._casac.ms()
-        self._ms.open(dataset_path)
+        self._visibility_cache = VisibilityCache(config.PIPELINE_CONFIGS['visibility_cache']['memory_budget_mb'])
+        self._backend = backend or self._create_backend()
+        self._backend.add_data_change_listener(self._visibility_cache.invalidate)
+        self._backend.add_data_change_listener(self._count_data_change)
+        self._flagging = False
+        self._flag_changes = 0
+        self._data_changes = {}  # column (None for every column) -> changes of visibilities other than flagdata
+        self._scan_cache = self._create_scan_cache()
+        self._prefetcher = self._create_prefetcher()
+        self._metadata = self._load_metadata()
+        self._flagging_timestamps = {}
         self._all_antenna_ids = self._all_antenna_ids()
-        self.flagged_antennas = self._initialize_flag_data()
+        self._antenna_states = AntennaStateStore(config.GLOBAL_CONFIGS['polarizations'], self.scan_ids(),
+                                                 self._all_antenna_ids)
         self._antennas = self.create_antennas()
-
-    def _allow_logs_above_warning_level(self):
-        sink = self._casac.logsink()
-        sink.showconsole(True)
-        sink.setglobal(True)
-        sink.filter('WARN')
+        self._unflagged_antennas = {}  # (polarization, scan id) -> antennas not flagged in that scan
+
+    def _create_backend(self):
+        data_source = config.PIPELINE_CONFIGS['data_source']
+        archive_path = os.path.join(data_source['archive_path'] or config.OUTPUT_PATH + "/data_archive",
+                                    os.path.basename(self._dataset_path.rstrip('/')))
+        if data_source['mode'] == 'replay':
+            return ReplayBackend(self._dataset_path, archive_path, self.casa_runner)
+        backend = CasacBackend(self._dataset_path, self.casa_runner)
+        if data_source['mode'] == 'record':
+            return RecordingBackend(backend, archive_path)
+        return backend
+
+    def _create_scan_cache(self):
+        scan_cache_config = config.PIPELINE_CONFIGS['scan_cache']
+        if not (scan_cache_config['enabled'] and os.path.isdir(self._dataset_path)): return None
+        scan_cache = PersistentScanCache(self._dataset_path,
+                                         scan_cache_config['path'] or config.OUTPUT_PATH + "/scan_cache")
+        self._backend.add_data_change_listener(scan_cache.invalidate)
+        return scan_cache
+
+    def _create_prefetcher(self):
+        # the prefetch process opens the dataset with its own casac tool, other backends are not shareable
+        if not (config.PIPELINE_CONFIGS['prefetch']['enabled'] and isinstance(self._backend, CasacBackend)):
+            return None
+        prefetcher = VisibilityPrefetcher(self._dataset_path, self.output_path)
+        self.casa_runner.dataset_handles.add_release_listener(prefetcher.discard)
+        return prefetcher
+
+    def _load_metadata(self):
+        fingerprint = self._backend.metadata_fingerprint()
+        sidecar_path = os.path.join(self.output_path,
+                                    os.path.basename(self._dataset_path.rstrip('/')) + ".metadata.pkl")
+        metadata = MetadataSnapshot.load(sidecar_path, fingerprint) if fingerprint else None
+        if metadata: return metadata
+
+        metadata = MetadataSnapshot.build(self._backend, [int(config.GLOBAL_CONFIGS['default_spw'])])
+        if fingerprint:
+            create_dir(self.output_path)
+            metadata.save(sidecar_path, fingerprint)
+        return metadata
 
     def __del__(self):
-        self._ms.close()
+        logger.debug("{0}, {1} for {2}".format(self._visibility_cache, self.casa_runner.dataset_handles,
+                                               self._dataset_path))
+        if self._prefetcher:
+            logger.debug("{0} for {1}".format(self._prefetcher, self._dataset_path))
+            self._prefetcher.close()
+        self._backend.close()
+
+    def reads_in_workers(self):
+        return self._backend.READS_IN_WORKERS
+
+    def use_worker_backend(self):
+        # in a forked worker process, which must share neither the casac tool nor the prefetch queues
+        self._backend = self._backend.worker_copy()
+        self._prefetcher = None
 
     def get_dataset_path(self):
         return self._dataset_path
@@ -44,46 +106,40 @@ class MeasurementSet:
     def get_output_path(self):
         return self.output_path
 
-    def _initialize_flag_data(self):
-        flag_data = {
-            polarization: {scan_id: set() for scan_id in self.scan_ids()} for
-            polarization in
-            config.GLOBAL_CONFIGS['polarizations']}
-        return flag_data
-
     def quack(self):
         self.casa_runner.quack()
 
-    def _filter(self, spw, channel, polarization, filters={}):
-        self._ms.selectinit(reset=True)
-        self._ms.msselect({"spw": spw})
-        self._ms.selectpolarization(polarization)
-        self._ms.selectchannel(**channel)
-        if filters: self._ms.select(filters)
+    def flagdata(self, flag_file, reasons="any"):
+        self._flagging = True
+        try:
+            self._backend.flagdata(flag_file, reasons)
+        finally:
+            self._flagging = False
 
-    def reload(self):
-        self._ms.close()
-        self._ms.open(self._dataset_path)
+    def _count_data_change(self, columns):
+        if self._flagging:
+            self._flag_changes += 1
+            return
+        for column in columns or [None]:
+            self._data_changes[column] = self._data_changes.get(column, 0) + 1
 
-    def create_antennas(self):
-        first_scan_id = self._ms.metadata().scannumbers()[0]
-        antenna_ids = self._ms.metadata().antennasforscan(first_scan_id).tolist()
-        antennas = map(lambda id: Antenna(id), antenna_ids)
-        product_pol_scan_ant = []
+    def flag_version(self):
+        # flagdata runs so far, which only change flags
+        return self._flag_changes
 
-        for polarization in config.GLOBAL_CONFIGS['polarizations']:
-            scan_ids = self.scan_ids(polarization=polarization)
-            product_pol_scan_ant += list(itertools.product([polarization], scan_ids, antennas))
+    def data_version(self, complex_column):
+        # other changes that may have rewritten the column, calibrations rewrite corrected_data
+        return self._data_changes.get(None, 0) + self._data_changes.get(complex_column, 0)
 
-        for polarization, scan_id, antenna in product_pol_scan_ant:
-            antennaState = AntennaState(antenna.id, polarization, scan_id)
-            antenna.add_state(antennaState)
+    def reload(self):
+        self._backend.reopen()
 
-        return antennas
+    def create_antennas(self):
+        return map(lambda id: Antenna(id, self._antenna_states), self._all_antenna_ids)
 
     def _all_antenna_ids(self):
-        first_scan_id = self._ms.metadata().scannumbers()[0]
-        return self._ms.metadata().antennasforscan(first_scan_id).tolist()
+        first_scan_id = self._metadata.scan_numbers()[0]
+        return self._metadata.antennas_for_scan(first_scan_id).tolist()
 
     def antenna_ids(self, polarization=None, scan_id=None):
         return map(lambda antenna: antenna.id, self.antennas(polarization, scan_id))
@@ -98,44 +154,104 @@ class MeasurementSet:
         return baselines
 
     def get_antenna_by_id(self, id):
-        return filter(lambda antenna: antenna.id == id, self.antennas())[0]
+        return self._antennas[self._all_antenna_ids.index(id)]
 
     def antennas(self, polarization=None, scan_id=None):
         if not (polarization or scan_id):
             return self._antennas
-        return filter(lambda antenna: antenna.id not in self.flagged_antennas[polarization][scan_id], self._antennas)
+        if (polarization, scan_id) not in self._unflagged_antennas:
+            unflagged_mask = self._antenna_states.unflagged_antenna_mask(polarization, scan_id)
+            self._unflagged_antennas[(polarization, scan_id)] = [antenna for antenna, unflagged in
+                                                                 zip(self._antennas, unflagged_mask) if unflagged]
+        return list(self._unflagged_antennas[(polarization, scan_id)])
+
+    def antenna_states(self):
+        return self._antenna_states
+
+    def _data_key(self, spw, channel, filters, selection_params):
+        complex_column = VisibilityData.COMPLEX_COLUMN_FOR[VisibilityData.data_column_in(selection_params)]
+        polarizations = config.GLOBAL_CONFIGS['polarizations']
+        return cache_key(spw, channel, tuple(polarizations), filters, [complex_column]), complex_column
 
     def get_data(self, spw, channel, polarization, filters, selection_params):
-        ifraxis = True  # This will always inserts a default value for the missing rows
-        self._filter(spw, channel, polarization, filters)
-        data_items = self._ms.getdata(selection_params, ifraxis=ifraxis)
-        return VisibilityData(data_items)
+        key, complex_column = self._data_key(spw, channel, filters, selection_params)
+        visibility_data = self._visibility_cache.get(key)
+        if visibility_data is None:
+            visibility_data = self._read_data(key, spw, channel, filters, complex_column)
+            self._visibility_cache.put(key, visibility_data, visibility_data.nbytes())
+        return visibility_data.for_polarization(polarization, VisibilityData.data_column_in(selection_params))
+
+    def prefetch(self, spw, channel, filters, selection_params):
+        if self._prefetcher is None or config.PIPELINE_CONFIGS['streaming']['enabled']: return
+        key, complex_column = self._data_key(spw, channel, filters, selection_params)
+        if key in self._visibility_cache: return
+        self._prefetcher.submit(key, spw, channel, config.GLOBAL_CONFIGS['polarizations'], filters,
+                                self._raw_columns(complex_column))
+
+    def prefetched(self, spw_polarization_scan_product, channel, selection_params):
+        # yields the work items in order, reading the scan of the next one while the current one is analysed
+        work_items = list(spw_polarization_scan_product)
+        for index, work_item in enumerate(work_items):
+            if index + 1 < len(work_items):
+                next_spw, _, next_scan_id = work_items[index + 1]
+                self.prefetch(next_spw, channel, {'scan_number': next_scan_id}, selection_params)
+            yield work_item
+
+    def _raw_columns(self, complex_column):
+        return ["antenna1", "antenna2", "time", "flag", complex_column]
+
+    def _read_data(self, key, spw, channel, filters, complex_column):
+        polarizations = config.GLOBAL_CONFIGS['polarizations']
+        if self._scan_cache:
+            visibility_data = self._scan_cache.load(key, polarizations)
+            if visibility_data is not None: return visibility_data
+
+        data_items = self._prefetcher.take(key) if self._prefetcher else None
+        if data_items is None:
+            data_items = self._backend.get_data(spw, channel, polarizations, filters,
+                                                self._raw_columns(complex_column))
+        visibility_data = VisibilityData.from_raw_data(data_items, polarizations, complex_column)
+        if self._scan_cache: self._scan_cache.store(key, visibility_data)
+        return visibility_data
+
+    def iter_data(self, spw, channel, polarization, filters, selection_params):
+        # reads only the one polarization a time chunk at a time, bypassing the visibility caches
+        data_column = VisibilityData.data_column_in(selection_params)
+        complex_column = VisibilityData.COMPLEX_COLUMN_FOR[data_column]
+        for data_items in self._backend.iter_data(spw, channel, [polarization], filters,
+                                                  self._raw_columns(complex_column), self._integrations_per_chunk()):
+            visibility_data = VisibilityData.from_raw_data(data_items, [polarization], complex_column)
+            yield visibility_data.for_polarization(polarization, data_column)
+
+    def _integrations_per_chunk(self):
+        antenna_count = len(self._all_antenna_ids)
+        rows_per_integration = antenna_count * (antenna_count + 1) / 2
+        # complex visibility, flag, derived amplitude or phase and its copy in the assembled matrix
+        complex_size = numpy.dtype(VisibilityData.complex_dtype()).itemsize
+        bytes_per_row = complex_size + 1 + complex_size  # the two float copies take as much as the complex value
+        chunk_bytes = config.PIPELINE_CONFIGS['streaming']['chunk_memory_mb'] * 1024 * 1024
+        return max(1, int(chunk_bytes / (rows_per_integration * bytes_per_row)))
 
     def get_phase_data(self, channel, polarization, filters={}):  # To be removed
         return PhaseSet(self.get_data("0", channel, polarization, filters, ['phase'])['phase'][0][0])
 
     def get_field_name_for(self, field_id):
-        return self._ms.metadata().fieldnames()[field_id]
+        return self._metadata.field_names()[field_id]
 
     def source_ids(self):
-        return self._ms.metadata().fieldsforspw(int(config.GLOBAL_CONFIGS['default_spw']))
+        return self._metadata.fields_for_spw(int(config.GLOBAL_CONFIGS['default_spw']))
 
     def _all_scan_ids(self, source_id=None):
         if source_id is None:
-            scan_ids = list(self._ms.metadata().scannumbers())
+            scan_ids = list(self._metadata.scan_numbers())
         else:
-            scan_ids = self._ms.metadata().scansforfield(source_id)
+            scan_ids = self._metadata.scans_for_field(source_id)
 
         return map(lambda scan_id: int(scan_id), scan_ids)
 
     def _get_unflagged_scan_ids_for(self, source_id, polarization):
-        antenna_ids = set(self._all_antenna_ids)
-
-        def _is_flagged(scan_id, polarization):
-            if not polarization: return False
-            return set(self.flagged_antennas[polarization][scan_id]) == antenna_ids
-
-        return filter(lambda scan_id: not _is_flagged(scan_id, polarization),
+        if not polarization: return self._all_scan_ids(source_id)
+        return filter(lambda scan_id: not self._antenna_states.is_completely_flagged(polarization, scan_id),
                       self._all_scan_ids(source_id))
 
     def scan_ids(self, source_ids=None, polarization=None):
@@ -147,30 +263,14 @@ class MeasurementSet:
 
         return scan_ids
 
-    def baselines_for(self, antenna, polarization, scan_id):
-        antennas = list(self.antennas(polarization, scan_id))
-        antennas.remove(antenna)
-        baselines = list(itertools.product(antennas, [antenna]))
-
-        def sort_antennas(baseline):
-            sorted_baseline = tuple(sorted(list(baseline), key=lambda antenna: antenna.id))
-            return sorted_baseline
-
-        return map(sort_antennas, baselines)
-
     def antenna_count(self, polarization, scan_id):
         return len(self.antennas(polarization, scan_id))
 
-    def timesforscan(self, scan_id, formatted=True):
-        times = self._ms.metadata().timesforscan(scan_id)
-        if not formatted: return times
-        quanta = self._casac.quanta()
-        times_with_second = map(lambda time: str(time) + 's', times)
-        return numpy.array(
-            map(lambda time: quanta.time(quanta.quantity(time), form='ymd'), times_with_second)).flatten()
+    def timesforscan(self, scan_id):
+        return self._metadata.times_for_scan(scan_id)
 
     def get_completely_flagged_antennas(self, polarization):
-        return list(set.intersection(*self.flagged_antennas[polarization].values()))
+        return self._antenna_states.completely_flagged_antenna_ids(polarization)
 
     def make_entry_in_flag_file(self, flag_file, polarizations, scan_ids, antenna_ids):
         if antenna_ids:
@@ -181,56 +281,57 @@ class MeasurementSet:
 
     def flag_antennas(self, flag_file, polarizations, scan_ids, antenna_ids):
         self.make_entry_in_flag_file(flag_file, polarizations, scan_ids, antenna_ids)
-        for polarization, scan_id in product(polarizations, scan_ids):
-            self.flagged_antennas[polarization][scan_id] = self.flagged_antennas[polarization][scan_id].union(
-                set(antenna_ids))
+        self._antenna_states.flag(polarizations, scan_ids, antenna_ids)
+        self._unflagged_antennas.clear()
 
     def flag_bad_antennas(self, flag_file, sources):
-        source_scan_ids = self.scan_ids(sources)
-        all_scan_ids = self.scan_ids()
-        for antenna in self._antennas:
-            for state in antenna.get_states(source_scan_ids):
-                if state.scan_id in all_scan_ids and state.is_bad():
-                    self.flag_antennas(flag_file, [state.polarization], [state.scan_id], [antenna.id])
-
-    def _get_timerange_for_flagging(self, timerange):
-        datetime_format = '%Y/%m/%d/%H:%M:%S'
-        time_delta = timedelta(seconds=1)
-        start = datetime.strptime(timerange[0], datetime_format)
-        end = datetime.strptime(timerange[1], datetime_format)
-        start_with_delta = datetime.strftime(start - time_delta, datetime_format)
-        end_with_delta = datetime.strftime(end + time_delta, datetime_format)
-        return start_with_delta, end_with_delta
-
-    def flag_bad_time(self, flag_file, polarization, scan_id, timerange):
-        timerange_for_flagging = self._get_timerange_for_flagging(timerange)
-        self.flag_recorder.mark_entry(flag_file,
-                                      {'mode': 'manual', 'reason': BAD_TIME, 'correlation': polarization,
-                                       'scan': scan_id, 'timerange': '~'.join(timerange_for_flagging)})
-
-    def flag_bad_antenna_time(self, flag_file, polarization, scan_id, antenna_id, timerange):
-        timerange_for_flagging = self._get_timerange_for_flagging(timerange)
-        self.flag_recorder.mark_entry(flag_file,
-                                      {'mode': 'manual', 'antenna': antenna_id, 'reason': BAD_ANTENNA_TIME,
-                                       'correlation': polarization,
-                                       'scan': scan_id, 'timerange': '~'.join(timerange_for_flagging)})
-
-    def flag_bad_baseline_time(self, flag_file, polarization, scan_id, baseline, timerange):
-        timerange_for_flagging = self._get_timerange_for_flagging(timerange)
-        self.flag_recorder.mark_entry(flag_file,
-                                      {'mode': 'manual', 'antenna': str(baseline), 'reason': BAD_BASELINE_TIME,
-                                       'correlation': polarization,
-                                       'scan': scan_id, 'timerange': '~'.join(timerange_for_flagging)})
+        scan_ids = self.scan_ids(sources) or self.scan_ids()
+        for antenna_id, polarization, scan_id in self._antenna_states.bad_states(scan_ids):
+            self.flag_antennas(flag_file, [polarization], [scan_id], [antenna_id])
+
+    def _get_timerange_for_flagging(self, scan_id, timerange):
+        # timerange holds MJD seconds of the scan, padded by a second on each side so CASA flags them inclusively
+        times = self.timesforscan(scan_id)
+        if scan_id not in self._flagging_timestamps:
+            self._flagging_timestamps[scan_id] = casa_timestamps(times - 1), casa_timestamps(times + 1)
+        starts, ends = self._flagging_timestamps[scan_id]
+        start_index, end_index = numpy.searchsorted(times, timerange)
+        return starts[start_index], ends[end_index]
+
+    def flagged_time_bounds(self, timerange):
+        # MJD seconds between which CASA flags a timerange, padded and rounded as _get_timerange_for_flagging does
+        return numpy.round(timerange[0] - 1), numpy.round(timerange[1] + 1)
+
+    def flag_bad_time(self, flag_file, polarization, scan_id, timerange, spw=None):
+        timerange_for_flagging = self._get_timerange_for_flagging(scan_id, timerange)
+        self._mark_time_entry(flag_file, spw,
+                              {'mode': 'manual', 'reason': BAD_TIME, 'correlation': polarization,
+                               'scan': scan_id, 'timerange': '~'.join(timerange_for_flagging)})
+
+    def flag_bad_antenna_time(self, flag_file, polarization, scan_id, antenna_id, timerange, spw=None):
+        timerange_for_flagging = self._get_timerange_for_flagging(scan_id, timerange)
+        self._mark_time_entry(flag_file, spw,
+                              {'mode': 'manual', 'antenna': antenna_id, 'reason': BAD_ANTENNA_TIME,
+                               'correlation': polarization,
+                               'scan': scan_id, 'timerange': '~'.join(timerange_for_flagging)})
+
+    def flag_bad_baseline_time(self, flag_file, polarization, scan_id, baseline, timerange, spw=None):
+        timerange_for_flagging = self._get_timerange_for_flagging(scan_id, timerange)
+        self._mark_time_entry(flag_file, spw,
+                              {'mode': 'manual', 'antenna': str(baseline), 'reason': BAD_BASELINE_TIME,
+                               'correlation': polarization,
+                               'scan': scan_id, 'timerange': '~'.join(timerange_for_flagging)})
+
+    def _mark_time_entry(self, flag_file, spw, details):
+        # entries without an spw flag every spw
+        if spw is not None: details['spw'] = spw
+        self.flag_recorder.mark_entry(flag_file, details)
 
     def get_bad_antennas_with_scans_for(self, polarization, source_id):
-        scan_ids = self.scan_ids(source_id, polarization)
-        bad_antennas_with_scans = {}
-        for scan_id in scan_ids:
-            bad_antennas = self.flagged_antennas[polarization][scan_id]
-            for antenna in bad_antennas:
-                if not antenna in bad_antennas_with_scans: bad_antennas_with_scans[antenna] = []
-                bad_antennas_with_scans[antenna].append(scan_id)
-        return bad_antennas_with_scans
+        return self._antenna_states.flagged_scan_ids_by_antenna(polarization, self.scan_ids(source_id, polarization))
+
+    def get_antennas_flagged_in_all_scans_of(self, polarization, source_ids):
+        return self._antenna_states.antenna_ids_flagged_in_all(polarization, self.scan_ids(source_ids, polarization))
 
     def split(self, output_ms, filters):
         self.casa_runner.split(output_ms, filters)
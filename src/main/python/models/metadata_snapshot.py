@@ -0,0 +1,62 @@
+import cPickle
+import os
+
+from utilities.logger import logger
+
+
+class MetadataSnapshot:
+    VERSION = 1
+
+    def __init__(self, scan_numbers, scans_for_fields, fields_for_spws, field_names, antennas_for_scans,
+                 times_for_scans):
+        self._scan_numbers = scan_numbers
+        self._scans_for_fields = scans_for_fields
+        self._fields_for_spws = fields_for_spws
+        self._field_names = field_names
+        self._antennas_for_scans = antennas_for_scans
+        self._times_for_scans = times_for_scans
+
+    @staticmethod
+    def build(backend, spws):
+        scan_numbers = map(int, backend.scan_numbers())
+        field_names = list(backend.field_names())
+        scans_for_fields = {field_id: backend.scans_for_field(field_id) for field_id in range(len(field_names))}
+        fields_for_spws = {spw: backend.fields_for_spw(spw) for spw in spws}
+        antennas_for_scans = {scan_id: backend.antennas_for_scan(scan_id) for scan_id in scan_numbers}
+        times_for_scans = {scan_id: backend.times_for_scan(scan_id) for scan_id in scan_numbers}
+        return MetadataSnapshot(scan_numbers, scans_for_fields, fields_for_spws, field_names, antennas_for_scans,
+                                times_for_scans)
+
+    @staticmethod
+    def load(sidecar_path, fingerprint):
+        if not os.path.exists(sidecar_path): return None
+        with open(sidecar_path, 'rb') as sidecar:
+            version, sidecar_fingerprint, snapshot = cPickle.load(sidecar)
+        if (version, sidecar_fingerprint) != (MetadataSnapshot.VERSION, fingerprint):
+            logger.debug("Metadata snapshot at {0} is stale".format(sidecar_path))
+            return None
+        return snapshot
+
+    def save(self, sidecar_path, fingerprint):
+        staging_path = sidecar_path + ".tmp{0}".format(os.getpid())
+        with open(staging_path, 'wb') as sidecar:
+            cPickle.dump((MetadataSnapshot.VERSION, fingerprint, self), sidecar, cPickle.HIGHEST_PROTOCOL)
+        os.rename(staging_path, sidecar_path)
+
+    def scan_numbers(self):
+        return self._scan_numbers
+
+    def scans_for_field(self, field_id):
+        return self._scans_for_fields[field_id]
+
+    def fields_for_spw(self, spw):
+        return self._fields_for_spws[spw]
+
+    def field_names(self):
+        return self._field_names
+
+    def antennas_for_scan(self, scan_id):
+        return self._antennas_for_scans[scan_id]
+
+    def times_for_scan(self, scan_id):
+        return self._times_for_scans[scan_id]
@@ -0,0 +1,71 @@
+import os
+import re
+import shutil
+import numpy
+
+from models.visibility_data import VisibilityData
+from utilities.helpers import create_dir, table_fingerprint
+from utilities.logger import logger
+
+
+class PersistentScanCache:
+    SCAN_ARRAYS = ['antenna1', 'antenna2', 'time']
+
+    def __init__(self, dataset_path, cache_path):
+        self._dataset_path = dataset_path
+        self._cache_path = os.path.join(cache_path, os.path.basename(dataset_path.rstrip('/')))
+        self._fingerprint = None
+
+    def invalidate(self, columns=None):
+        self._fingerprint = None  # CASA has rewritten the table, recompute the fingerprint on next access
+
+    def _table_fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = table_fingerprint(self._dataset_path)
+            self._remove_stale_scans()
+        return self._fingerprint
+
+    def _remove_stale_scans(self):
+        # scans persisted for earlier states of the table are never read again, only the current state is kept
+        if not os.path.isdir(self._cache_path): return
+        for fingerprint in os.listdir(self._cache_path):
+            if fingerprint != self._fingerprint:
+                shutil.rmtree(os.path.join(self._cache_path, fingerprint), ignore_errors=True)
+                logger.debug("Removed stale scan data at {0}".format(os.path.join(self._cache_path, fingerprint)))
+
+    def _scan_path(self, key):
+        selection = [key.spw, key.channel, key.filters, key.columns, numpy.dtype(VisibilityData.complex_dtype()).name]
+        scan_name = re.sub(r'[^0-9a-zA-Z]+', '_', str(selection)).strip('_')
+        return os.path.join(self._cache_path, self._table_fingerprint(), scan_name)
+
+    def load(self, key, polarizations):
+        scan_path = self._scan_path(key)
+        if not all(os.path.exists(self._array_path(scan_path, polarization, 'flags')) for polarization in
+                   polarizations):
+            return None
+        scan_arrays = [self._load_array(scan_path, None, name) for name in PersistentScanCache.SCAN_ARRAYS]
+        visibilities = [self._load_array(scan_path, polarization, 'visibilities') for polarization in polarizations]
+        flags = [self._load_array(scan_path, polarization, 'flags') for polarization in polarizations]
+        return VisibilityData(*(scan_arrays + [visibilities, flags, polarizations]))
+
+    def store(self, key, visibility_data):
+        scan_path = self._scan_path(key)
+        staging_path = scan_path + ".tmp{0}".format(os.getpid())
+        create_dir(staging_path)
+        for name in PersistentScanCache.SCAN_ARRAYS:
+            numpy.save(self._array_path(staging_path, None, name), getattr(visibility_data, name))
+        for polarization in visibility_data.polarizations():
+            numpy.save(self._array_path(staging_path, polarization, 'visibilities'),
+                       visibility_data.visibilities_for(polarization))
+            numpy.save(self._array_path(staging_path, polarization, 'flags'), visibility_data.flags_for(polarization))
+
+        if os.path.exists(scan_path): shutil.rmtree(scan_path)
+        os.rename(staging_path, scan_path)
+        logger.debug("Persisted scan data at {0}".format(scan_path))
+
+    def _array_path(self, scan_path, polarization, name):
+        file_name = "{0}.npy".format(name) if polarization is None else "{0}_{1}.npy".format(polarization, name)
+        return os.path.join(scan_path, file_name)
+
+    def _load_array(self, scan_path, polarization, name):
+        return numpy.load(self._array_path(scan_path, polarization, name), mmap_mode='r')
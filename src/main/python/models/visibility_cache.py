@@ -0,0 +1,66 @@
+from collections import OrderedDict, namedtuple
+
+from utilities.logger import logger
+
+VisibilityCacheKey = namedtuple('VisibilityCacheKey', 'spw, channel, polarization, filters, columns')
+
+
+def cache_key(spw, channel, polarization, filters, columns):
+    return VisibilityCacheKey(spw, tuple(sorted(channel.items())), polarization, tuple(sorted(filters.items())),
+                              tuple(columns))
+
+
+class VisibilityCache:
+    BYTES_IN_MB = 1024 * 1024
+
+    def __init__(self, memory_budget_mb):
+        self._memory_budget = memory_budget_mb * VisibilityCache.BYTES_IN_MB
+        self._entries = OrderedDict()
+        self._used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry = self._entries.pop(key)
+        self._entries[key] = entry  # move to the most recently used end
+        return entry[0]
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def put(self, key, value, size):
+        if key in self._entries: self._evict(key)
+        if size > self._memory_budget:
+            logger.debug("Visibility data of {0} bytes exceeds cache budget, not caching".format(size))
+            return
+        while self._used_bytes + size > self._memory_budget:
+            self._evict(next(iter(self._entries)))
+        self._entries[key] = (value, size)
+        self._used_bytes += size
+
+    def invalidate(self, columns=None):
+        if columns is None:
+            stale_keys = list(self._entries)
+        else:
+            stale_keys = [key for key in self._entries if set(key.columns).intersection(columns)]
+        for key in stale_keys:
+            self._evict(key)
+        logger.debug("Invalidated {0} visibility cache entries, {1}".format(len(stale_keys), self))
+
+    def _evict(self, key):
+        value, size = self._entries.pop(key)
+        self._used_bytes -= size
+
+    def used_bytes(self):
+        return self._used_bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return "VisibilityCache(entries={0}, used={1}B, budget={2}B, hits={3}, misses={4})".format(
+            len(self._entries), self._used_bytes, self._memory_budget, self.hits, self.misses)
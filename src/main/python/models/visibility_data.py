@@ -1,55 +1,101 @@
-import re
+import copy
 import numpy
-from itertools import imap
+
+from configs import config
 
 
 class VisibilityData:
-    DATA_COLUMN_IN_RAW_DATA = ['corrected_phase', 'corrected_amplitude', 'phase', 'amplitude']
-    FLAG_COLUMN_IN_RAW_DATA = ['flag']
-
-    def __init__(self, raw_data):
-        for key, value in raw_data.iteritems():
-            key, value = self._sanatize_input_data(key, value)
-            setattr(self, key, value)
-
-    def _sanatize_input_data(self, key, value):
-        if key in VisibilityData.DATA_COLUMN_IN_RAW_DATA:
-            key = 'data'
-            value = value[0][0]
-        if key in VisibilityData.FLAG_COLUMN_IN_RAW_DATA:
-            value = value[0][0]
-        return key, value
+    COMPLEX_COLUMN_FOR = {'amplitude': 'data', 'phase': 'data',
+                          'corrected_amplitude': 'corrected_data', 'corrected_phase': 'corrected_data'}
+    AMPLITUDE_COLUMNS = ['amplitude', 'corrected_amplitude']
+
+    def __init__(self, antenna1, antenna2, time, visibilities, flags, polarizations):
+        self.antenna1 = antenna1
+        self.antenna2 = antenna2
+        self.time = time
+        self._polarizations = list(polarizations)
+        # [baseline, time] arrays per polarization, either views over one getdata result or memory mapped files
+        self._visibilities = visibilities
+        self._flags = flags
+        self._derived_data = {}
+        self._baseline_rows = self._build_baseline_rows()
+        self.data = None
+        self.flag = None
+        self._masked_data = None
+
+    def _build_baseline_rows(self):
+        antenna_count = int(max(self.antenna1.max(), self.antenna2.max())) + 1 if self.antenna1.size else 0
+        baseline_rows = numpy.full((antenna_count, antenna_count), -1, dtype=int)
+        baseline_rows[self.antenna1, self.antenna2] = numpy.arange(self.antenna1.size)
+        return baseline_rows
+
+    @staticmethod
+    def complex_dtype():
+        # float32 is precise enough for median and MAD based flagging, and halves the memory of every array
+        return numpy.complex64 if config.PIPELINE_CONFIGS['precision'] == 'float32' else numpy.complex128
+
+    @staticmethod
+    def from_raw_data(raw_data, polarizations, complex_column):
+        # getdata returns [polarization, channel, baseline, time], the channels are averaged into one
+        visibilities = raw_data[complex_column][:, 0].astype(VisibilityData.complex_dtype(), copy=False)
+        return VisibilityData(raw_data['antenna1'], raw_data['antenna2'], raw_data['time'],
+                              visibilities, raw_data['flag'][:, 0], polarizations)
+
+    def polarizations(self):
+        return self._polarizations
+
+    def visibilities_for(self, polarization):
+        return self._visibilities[self._polarizations.index(polarization)]
+
+    def flags_for(self, polarization):
+        return self._flags[self._polarizations.index(polarization)]
+
+    @staticmethod
+    def data_column_in(selection_params):
+        return filter(lambda column: column in VisibilityData.COMPLEX_COLUMN_FOR, selection_params)[0]
+
+    def for_polarization(self, polarization, data_column):
+        polarization_index = self._polarizations.index(polarization)
+        polarization_view = copy.copy(self)
+        polarization_view.data = self._derive(polarization_index, data_column)
+        polarization_view.flag = self._flags[polarization_index]
+        polarization_view._masked_data = None
+        return polarization_view
+
+    def _derive(self, polarization_index, data_column):
+        key = (polarization_index, data_column in VisibilityData.AMPLITUDE_COLUMNS)
+        if key not in self._derived_data:
+            visibilities = self._visibilities[polarization_index]
+            self._derived_data[key] = numpy.abs(visibilities) if key[1] else numpy.angle(visibilities)
+        return self._derived_data[key]
+
+    def nbytes(self):
+        arrays = [self.antenna1, self.antenna2, self.time] + list(self._visibilities) + list(self._flags)
+        visibility_bytes = sum(visibilities.nbytes for visibilities in self._visibilities)
+        # amplitude and phase derived for every polarization together take as much as the complex visibilities
+        return sum(array.nbytes for array in arrays) + visibility_bytes
+
+    def _row_for(self, antenna1, antenna2):
+        if 0 <= antenna1 < len(self._baseline_rows) and 0 <= antenna2 < len(self._baseline_rows):
+            return self._baseline_rows[antenna1, antenna2]
+        return -1
 
     def baseline_index(self, baseline):
-        baseline_index = numpy.logical_and(self.antenna1 == baseline[0], self.antenna2 == baseline[1]).nonzero()[0]
-        return baseline_index[0] if baseline_index.size else numpy.nan
-
-    def mask_baseline_data(self, baseline_index, mask_with=numpy.nan):
-        baseline_data = self.data[baseline_index]
-        baseline_flags = self.flag[baseline_index]
-        return list(imap(lambda amplitude, flag: mask_with if flag else amplitude, baseline_data, baseline_flags))
-
-    def phase_data_present_for_baseline(self, baseline):
-        baseline = tuple(sorted(baseline))
-        return True if self.baseline_index(baseline) else False
-
-    def phase_data_present_for_triplet(self, triplet):
-        triplet_baselines_flag_status = {}
-        baseline_combinations = [(triplet[0].id, triplet[1].id),
-                                 (triplet[1].id, triplet[2].id),
-                                 (triplet[0].id, triplet[2].id)]
-
-        for baseline in baseline_combinations:
-            triplet_baselines_flag_status[baseline] = self._flags_status_for(baseline)
-
-        return self._is_triplet_flagged(triplet_baselines_flag_status)
-
-    def _is_triplet_flagged(self, triplet_baselines_flag_status):
-        return not all(sum(triplet_baselines_flag_status.values()))
-
-    def _flags_status_for(self, baseline):
-        baseline = tuple(sorted(baseline))
-        if not self.phase_data_present_for_baseline(baseline): return True
-        baseline_index = self.baseline_index(baseline)
-        phase_data_flags_status = self.flag[baseline_index]
-        return phase_data_flags_status
+        row = self._row_for(baseline[0], baseline[1])
+        return row if row >= 0 else numpy.nan
+
+    def baseline_rows_between(self, antenna_ids):
+        # [antenna, antenna] rows of the baselines among antenna_ids in stored orientation, -1 where there is none
+        antenna_ids = numpy.asarray(antenna_ids, dtype=int)
+        known = antenna_ids < len(self._baseline_rows)
+        rows = numpy.full((len(antenna_ids), len(antenna_ids)), -1, dtype=int)
+        rows[numpy.ix_(known, known)] = self._baseline_rows[numpy.ix_(antenna_ids[known], antenna_ids[known])]
+        return rows
+
+    def masked_data(self):
+        # computed once for a polarization view, the initial analysers of a scan share it
+        if self._masked_data is None: self._masked_data = numpy.where(self.flag, numpy.nan, self.data)
+        return self._masked_data
+
+    def masked_rows(self, baseline_indices, mask_with=numpy.nan):
+        return numpy.where(self.flag[baseline_indices], mask_with, self.data[baseline_indices])
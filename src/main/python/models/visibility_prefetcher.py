@@ -0,0 +1,115 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import traceback
+import numpy
+
+from utilities.logger import logger
+
+SHARED_MEMORY_PATH = '/dev/shm'
+
+
+def _read_scans(dataset_path, output_path, slot_paths, requests, responses):
+    # runs in the prefetch process with a casac ms tool of its own, casac is not safe to share
+    from backends.casac_backend import CasacBackend
+    from casa.casa_runner import CasaRunner
+    backend = CasacBackend(dataset_path, CasaRunner(dataset_path, output_path))
+    for request_id, slot, selection in iter(requests.get, None):
+        try:
+            data_items = backend.get_data(*selection)
+            for column, data in data_items.iteritems():
+                numpy.save(os.path.join(slot_paths[slot], column + '.npy'), data)
+            responses.put((request_id, None))
+        except Exception:
+            responses.put((request_id, traceback.format_exc()))
+        finally:
+            backend.close()  # CASA writers must not wait on the prefetch process
+
+
+class VisibilityPrefetcher:
+    SLOTS = 2  # one buffer is filled while the other is read
+
+    def __init__(self, dataset_path, output_path):
+        self._dataset_path = dataset_path
+        self._output_path = output_path
+        self._buffer_path = tempfile.mkdtemp(prefix='artip_prefetch_', dir=self._shared_memory_dir())
+        self._slot_paths = [os.path.join(self._buffer_path, "slot_{0}".format(slot)) for slot in
+                            range(VisibilityPrefetcher.SLOTS)]
+        map(os.mkdir, self._slot_paths)
+        self._requests = multiprocessing.Queue()
+        self._responses = multiprocessing.Queue()
+        self._process = None
+        self._next_request_id = 0
+        self._in_flight = {}  # request id -> (key, slot)
+        self._ready = {}  # key -> (slot, error)
+        self.hits = 0
+        self.discarded = 0
+
+    def _shared_memory_dir(self):
+        return SHARED_MEMORY_PATH if os.path.isdir(SHARED_MEMORY_PATH) else None
+
+    def _start(self):
+        self._process = multiprocessing.Process(target=_read_scans,
+                                                args=(self._dataset_path, self._output_path, self._slot_paths,
+                                                      self._requests, self._responses))
+        self._process.daemon = True
+        self._process.start()
+
+    def _free_slot(self):
+        used_slots = [slot for _, slot in self._in_flight.values()] + [slot for slot, _ in self._ready.values()]
+        free_slots = [slot for slot in range(VisibilityPrefetcher.SLOTS) if slot not in used_slots]
+        return free_slots[0] if free_slots else None
+
+    def is_pending(self, key):
+        return key in self._ready or key in [pending_key for pending_key, _ in self._in_flight.values()]
+
+    def submit(self, key, spw, channel, polarizations, filters, columns):
+        slot = self._free_slot()
+        if slot is None or self.is_pending(key): return
+        if self._process is None: self._start()
+        self._in_flight[self._next_request_id] = (key, slot)
+        self._requests.put((self._next_request_id, slot, (spw, channel, polarizations, filters, columns)))
+        self._next_request_id += 1
+
+    def _receive(self):
+        request_id, error = self._responses.get()
+        key, slot = self._in_flight.pop(request_id)
+        self._ready[key] = (slot, error)
+
+    def take(self, key):
+        if not self.is_pending(key): return None
+        while key not in self._ready:
+            self._receive()
+        slot, error = self._ready.pop(key)
+        if error:
+            logger.warn("Prefetch of {0} failed, reading it again\n{1}".format(key, error))
+            return None
+        slot_path = self._slot_paths[slot]
+        data_items = {}
+        for file_name in os.listdir(slot_path):
+            data_items[file_name[:-len('.npy')]] = numpy.load(os.path.join(slot_path, file_name))
+            os.remove(os.path.join(slot_path, file_name))
+        self.hits += 1
+        return data_items
+
+    def discard(self, columns=None):
+        # waits for reads in progress, whatever was read before CASA changed the dataset is stale
+        while self._in_flight:
+            self._receive()
+        for slot, _ in self._ready.values():
+            for file_name in os.listdir(self._slot_paths[slot]):
+                os.remove(os.path.join(self._slot_paths[slot], file_name))
+        self.discarded += len(self._ready)
+        self._ready.clear()
+
+    def close(self):
+        self.discard()
+        if self._process is not None:
+            self._requests.put(None)
+            self._process.join()
+            self._process = None
+        shutil.rmtree(self._buffer_path, ignore_errors=True)
+
+    def __repr__(self):
+        return "VisibilityPrefetcher(hits={0}, discarded={1})".format(self.hits, self.discarded)
@@ -33,7 +33,7 @@ class PipelineStage(object):
         self._measurement_set.quack()
         if config.MAIN_STAGES['flag_known_bad_data']:
             flag_file = "{0}/user_defined_flags.txt".format(config.CONFIG_PATH)
-            self._measurement_set.casa_runner.flagdata(flag_file)
+            self._measurement_set.flagdata(flag_file)
         self._measurement_set.generate_flag_summary("known_flags")
 
     @_run(config.MAIN_STAGES['flux_calibration'])
@@ -9,6 +9,7 @@ class BandpassCalibrator(Source):
         self.source_ids = config.GLOBAL_CONFIGS['bandpass_cal_fields']
         super(BandpassCalibrator, self).__init__(measurement_set)
 
-    def calibrate(self):
+    def calibrate(self, scan_ids=None):
+        # the bandpass solution spans the scans, it is applied to all of them
         self.measurement_set.casa_runner.apply_bandpass_calibration(self.config)
         self.measurement_set.casa_runner.apply_flux_calibration(self.config, 2)
@@ -23,7 +23,7 @@ class ContinuumSource(Source):
     def reduce_data(self):
         self.flag_and_calibrate_in_detail()
 
-    def calibrate(self):
+    def calibrate(self, scan_ids=None):
         pass
 
     def flag_and_calibrate_in_detail(self):
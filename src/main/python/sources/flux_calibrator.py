@@ -23,13 +23,15 @@ class FluxCalibrator(Source):
     def _extend_bad_antennas_across_all_sources(self):
         polarizations = config.GLOBAL_CONFIGS['polarizations']
         for polarization in polarizations:
-            scan_ids = self.measurement_set.scan_ids(self.source_ids, polarization)
-            antennas_with_scans = self.measurement_set.get_bad_antennas_with_scans_for(polarization, self.source_ids)
-            bad_antennas = filter(lambda antenna: len(antennas_with_scans[antenna]) == len(scan_ids),
-                                  antennas_with_scans.keys())
+            bad_antennas = self.measurement_set.get_antennas_flagged_in_all_scans_of(polarization, self.source_ids)
 
             self.measurement_set.flag_antennas(self.flag_file, [polarization], self.measurement_set.scan_ids(), bad_antennas)
 
-    def calibrate(self):
-        self.measurement_set.casa_runner.apply_flux_calibration(self.config, 1)
+    def _scan_ids_changed_by_calibration(self, flagged_scan_ids):
+        # only the scans with new flags get other gains
+        return flagged_scan_ids
+
+    def calibrate(self, scan_ids=None):
+        # gains are solved per scan, so applying them to the given scans leaves the other scans as they were
+        self.measurement_set.casa_runner.apply_flux_calibration(self.config, 1, scan_ids)
         self.measurement_set.reload()
@@ -15,7 +15,8 @@ class PhaseCalibrator(Source):
         logger.info(Color.HEADER + "Extending flags..." + Color.ENDC)
         self._extend_bad_antennas_on_target_source()
 
-    def calibrate(self):
+    def calibrate(self, scan_ids=None):
+        # fluxscale derives one scale from all scans of the field, so the solutions are applied to all of them
         flux_cal_fields = ",".join(map(str, config.GLOBAL_CONFIGS['flux_cal_fields']))
         self.measurement_set.casa_runner.apply_phase_calibration(flux_cal_fields, self.config)
 
@@ -23,16 +24,12 @@ class PhaseCalibrator(Source):
         polarizations = config.GLOBAL_CONFIGS['polarizations']
         for polarization in polarizations:
             phase_cal_fields = config.GLOBAL_CONFIGS['phase_cal_fields']
-            completely_bad_antennas = self.measurement_set.get_completely_flagged_antennas(polarization)
+            completely_bad_antennas = set(self.measurement_set.get_completely_flagged_antennas(polarization))
             antennas_with_scans = self.measurement_set.get_bad_antennas_with_scans_for(polarization, phase_cal_fields)
 
-            for completely_bad_antenna in completely_bad_antennas:
-                del antennas_with_scans[completely_bad_antenna]
-
-            for antenna_id, bad_scan_ids in antennas_with_scans.iteritems():
-                if len(bad_scan_ids) > 1:
-                    bad_scan_ids.sort()
-                    self._flag_bad_scans(polarization, antenna_id, bad_scan_ids, phase_cal_fields)
+            for antenna_id, bad_scan_ids in sorted(antennas_with_scans.iteritems()):
+                if antenna_id not in completely_bad_antennas and len(bad_scan_ids) > 1:
+                    self._flag_bad_scans(polarization, antenna_id, sorted(bad_scan_ids), phase_cal_fields)
 
     def _flag_bad_scans(self, polarization, antenna_id, bad_scan_ids, source_ids):
         for bad_scan_id in bad_scan_ids:
@@ -3,9 +3,11 @@ from utilities.logger import logger
 from utilities.helpers import create_dir
 from analysers.initial.angular_dispersion import AngularDispersion
 from analysers.initial.closure_analyser import ClosureAnalyser
+from analysers.initial.fused_analyser import FusedAnalyser
 from analysers.detailed.detailed_analyser import DetailedAnalyser
 from casa.flag_reasons import BAD_ANTENNA, BAD_ANTENNA_TIME, BAD_BASELINE_TIME, BAD_TIME
 from configs import config
+from models.visibility_data import VisibilityData
 from utilities.terminal_color import Color
 from analysers.initial.report import Report
 
@@ -14,6 +16,7 @@ class Source(object):
     def __init__(self, measurement_set):
         self.measurement_set = measurement_set
         self.flag_file = config.OUTPUT_PATH + "/" + "flags_{0}.txt".format(self.source_type)
+        self.calibration_runs = 0  # of detailed flagging
 
     def run_rflag(self):
         self.measurement_set.casa_runner.r_flag(self.source_type, self.source_ids)
@@ -27,7 +30,8 @@ class Source(object):
         self.measurement_set.casa_runner.generate_flag_summary("tfcrop",
                                                                scan_ids, self.source_type)
 
-    def calibrate(self):
+    def calibrate(self, scan_ids=None):
+        # scan_ids are the scans whose calibrated data has to be refreshed, None for all of them
         raise NotImplementedError("Not implemented")
 
     def reduce_data(self):
@@ -36,60 +40,130 @@ class Source(object):
         self.flag_and_calibrate_in_detail()
 
     def flag_antennas(self):
-        self.analyse_antennas_on_angular_dispersion()
-        self.analyse_antennas_on_closure_phases()
+        self.analyse_antennas_on_angular_dispersion_and_closure_phases()
 
         scan_ids = self.measurement_set.scan_ids(self.source_ids)
-        Report(self.measurement_set.antennas()).generate_report(scan_ids)
+        Report(self.measurement_set.antenna_states()).generate_report(scan_ids)
         self.measurement_set.flag_bad_antennas(self.flag_file, self.source_ids)
         self.extend_flags()
-        self.measurement_set.casa_runner.flagdata(self.flag_file, BAD_ANTENNA)
+        self.measurement_set.flagdata(self.flag_file, BAD_ANTENNA)
         self.measurement_set.casa_runner.generate_flag_summary("rang_closure",
                                                                scan_ids, self.source_type)
 
     def flag_and_calibrate_in_detail(self):
         logger.info(Color.HEADER + "Started Detail Flagging..." + Color.ENDC)
         detailed_analyser = DetailedAnalyser(self.measurement_set, self.config, self.flag_file)
-        self._flag_bad_time(BAD_TIME, detailed_analyser.analyse_time, True)
-        self._flag_bad_time(BAD_ANTENNA_TIME, detailed_analyser.analyse_antennas, False)
-        self._flag_bad_time(BAD_BASELINE_TIME, detailed_analyser.analyse_baselines, False)
+        detailed_passes = [(BAD_TIME, detailed_analyser.analyse_time, True),
+                           (BAD_ANTENNA_TIME, detailed_analyser.analyse_antennas, False),
+                           (BAD_BASELINE_TIME, detailed_analyser.analyse_baselines, False)]
+        if config.PIPELINE_CONFIGS['recalibration']['deferred']:
+            self._flag_in_detail_before_calibrating(detailed_passes)
+        else:
+            for reason, analyser, run_only_once in detailed_passes:
+                self._flag_bad_time(reason, analyser, run_only_once)
+        logger.info("Calibrated {0} {1} times during detailed flagging".format(self.source_type,
+                                                                               self.calibration_runs))
         scan_ids = self.measurement_set.scan_ids(self.source_ids)
         self.measurement_set.casa_runner.generate_flag_summary("detailed_flagging",
                                                                scan_ids, self.source_type)
 
-    def _flag_bad_time(self, reason, analyser, run_only_once):
+    def _flag_in_detail_before_calibrating(self, detailed_passes):
+        # the passes gather their flags without calibrating in between, then the flagged scans are calibrated once
+        # and the scans the calibration changed are analysed again until no new flags are found or the runs are spent
+        max_calibration_runs = config.PIPELINE_CONFIGS['recalibration']['max_calibration_runs']
+        work_items = self._spw_polarization_scan_product()
+        items_to_analyse = work_items
+        while True:
+            flagged_items = set()
+            for reason, analyser, run_only_once in detailed_passes:
+                flagged_items |= self.analyse_and_flag(reason, analyser, items_to_analyse, run_only_once, False)
+            if not flagged_items:
+                logger.info(Color.OKGREEN + "Detailed flagging converged" + Color.ENDC)
+                return
+
+            flagged_scan_ids = sorted(set(scan_id for _, _, scan_id in flagged_items))
+            recalibrated_scan_ids = self._scan_ids_changed_by_calibration(flagged_scan_ids)
+            data_version = self._amplitude_data_version()
+            self._recalibrate(flagged_scan_ids)
+            if data_version == self._amplitude_data_version():
+                logger.info(Color.OKGREEN + "Detailed flagging converged, calibration left the amplitudes as they "
+                                            "were" + Color.ENDC)
+                return
+            if self.calibration_runs >= max_calibration_runs:
+                logger.warning(Color.WARNING + "Stopped detailed flagging after {0} calibration runs, recalibrated "
+                                               "scans {1} are not analysed again".format(
+                                                   max_calibration_runs, recalibrated_scan_ids) + Color.ENDC)
+                return
+            # passes that run only once are not repeated on the recalibrated data
+            detailed_passes = [detailed_pass for detailed_pass in detailed_passes if not detailed_pass[2]]
+            items_to_analyse = [work_item for work_item in work_items if work_item[2] in recalibrated_scan_ids]
+
+    def _recalibrate(self, scan_ids=None):
+        self.calibration_runs += 1
+        self.calibrate(scan_ids)
+
+    def _spw_polarization_scan_product(self):
         spw_polarization_scan_id_combination = []
-        spw = config.GLOBAL_CONFIGS['default_spw']
+        if config.PIPELINE_CONFIGS['detailed_flagging']['all_spws']:
+            spws = [spw.strip() for spw in config.GLOBAL_CONFIGS['spw_range'].split(',')]
+        else:
+            spws = [config.GLOBAL_CONFIGS['default_spw']]
 
         for polarization in config.GLOBAL_CONFIGS['polarizations']:
             scan_ids = self.measurement_set.scan_ids(self.source_ids, polarization)
-            spw_polarization_scan_id_combination += list(itertools.product(spw, [polarization], scan_ids))
+            spw_polarization_scan_id_combination += list(itertools.product(spws, [polarization], scan_ids))
+        return spw_polarization_scan_id_combination
 
-        self.analyse_and_flag(reason, analyser, spw_polarization_scan_id_combination, run_only_once)
+    def _flag_bad_time(self, reason, analyser, run_only_once):
+        self.analyse_and_flag(reason, analyser, self._spw_polarization_scan_product(), run_only_once)
 
-    def analyse_and_flag(self, reason, analyser, spw_polarization_scan_product, run_only_once):
+    def analyse_and_flag(self, reason, analyser, spw_polarization_scan_product, run_only_once, recalibrate=True):
+        work_items = list(spw_polarization_scan_product)
+        items_to_analyse = work_items
+        all_flagged_items = set()
+        iteration = 1
         while True:
-            bad_time_present = analyser(spw_polarization_scan_product)
-            if bad_time_present:
+            flagged_items = analyser(items_to_analyse)
+            all_flagged_items |= flagged_items
+            if flagged_items:
                 logger.info(Color.HEADER + 'Flagging {0} in CASA'.format(reason) + Color.ENDC)
-                self.measurement_set.casa_runner.flagdata(self.flag_file, reason)
-                self.calibrate()
+                self.measurement_set.flagdata(self.flag_file, reason)
+                data_version = self._amplitude_data_version()
+                if recalibrate: self._recalibrate()
+                recalibrated = data_version != self._amplitude_data_version()
             else:
                 logger.info(Color.OKGREEN + 'No {0} Found'.format(reason) + Color.ENDC)
                 break
 
             if run_only_once: break
-
-    def analyse_antennas_on_closure_phases(self):
-        logger.info(Color.HEADER + "Identifying bad Antennas based on closure phases..." + Color.ENDC)
-        closure_analyser = ClosureAnalyser(self.measurement_set, self)
-        closure_analyser.identify_antennas_status()
-
-    def analyse_antennas_on_angular_dispersion(self):
-        logger.info(
-            Color.HEADER + "Identifying bad Antennas based on angular dispersion in phases..." + Color.ENDC)
-        r_analyser = AngularDispersion(self.measurement_set, self)
-        r_analyser.identify_antennas_status()
+            items_to_analyse = self._items_to_reanalyse(work_items, flagged_items, recalibrated)
+            iteration += 1
+            logger.info("{0} iteration {1}: re-analysing {2} of {3} items, skipping {4}".format(
+                reason, iteration, len(items_to_analyse), len(work_items), len(work_items) - len(items_to_analyse)))
+        return all_flagged_items
+
+    def _amplitude_data_version(self):
+        amplitude_data_column = self.config['detail_flagging']['amplitude_data_column']
+        return self.measurement_set.data_version(VisibilityData.COMPLEX_COLUMN_FOR[amplitude_data_column])
+
+    def _items_to_reanalyse(self, work_items, flagged_items, recalibrated):
+        # flags of an item may apply to its scan in every spw, and a recalibration changes the scans its solutions span
+        flagged_scans = set((polarization, scan_id) for _, polarization, scan_id in flagged_items)
+        recalibrated_scan_ids = set(self._scan_ids_changed_by_calibration(
+            sorted(set(scan_id for _, scan_id in flagged_scans)))) if recalibrated else set()
+        return [(spw, polarization, scan_id) for spw, polarization, scan_id in work_items
+                if (polarization, scan_id) in flagged_scans or scan_id in recalibrated_scan_ids]
+
+    def _scan_ids_changed_by_calibration(self, flagged_scan_ids):
+        # solutions of calibrators span the scans of the field, and fluxscale rescales every antenna of it
+        return self.measurement_set.scan_ids(self.source_ids)
+
+    def analyse_antennas_on_angular_dispersion_and_closure_phases(self):
+        logger.info(Color.HEADER + "Identifying bad Antennas based on angular dispersion in phases and on closure "
+                                   "phases..." + Color.ENDC)
+        fused_analyser = FusedAnalyser(self.measurement_set, self, [AngularDispersion(self.measurement_set, self),
+                                                                    ClosureAnalyser(self.measurement_set, self)])
+        fused_analyser.identify_antennas_status()
 
     def _prepare_output_dir(self, new_dir):
         output_path = config.OUTPUT_PATH + "/" + new_dir
@@ -13,7 +13,7 @@ class TargetSource(Source):
         self.source_ids = [source_id]
         super(TargetSource, self).__init__(measurement_set)
 
-    def calibrate(self):
+    def calibrate(self, scan_ids=None):
         self.measurement_set.casa_runner.apply_target_source_calibration(self.source_ids[0])
 
     def line(self):
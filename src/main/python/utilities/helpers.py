@@ -1,7 +1,10 @@
+import hashlib
 import numpy
 import math
 import os
 
+MJD_EPOCH = numpy.datetime64('1858-11-17T00:00:00', 's')
+
 
 def minus(list1, list2):
     return filter(lambda elm: elm not in list2, list1)
@@ -26,3 +29,20 @@ def calculate_percentage(favourable, total):
 
 def format_spw_with_channels(spw_list, channel):
     return ",".join(["{0}:{1}".format(s, channel) for s in spw_list.split(",")])
+
+
+def table_fingerprint(table_path, with_mtime=True, ignored_files=('table.lock',)):
+    table_state = hashlib.sha1()
+    for file_name in sorted(os.listdir(table_path)):
+        file_path = os.path.join(table_path, file_name)
+        if os.path.isfile(file_path) and file_name not in ignored_files:
+            file_stat = os.stat(file_path)
+            table_state.update("{0}:{1}:{2};".format(file_name, file_stat.st_size,
+                                                      file_stat.st_mtime if with_mtime else ''))
+    return table_state.hexdigest()
+
+
+def casa_timestamps(mjd_seconds):
+    # 'YYYY/MM/DD/hh:mm:ss' strings as CASA expects them in a timerange selection, rounded to the second
+    datetimes = MJD_EPOCH + numpy.round(mjd_seconds).astype(numpy.int64).astype('timedelta64[s]')
+    return numpy.char.replace(numpy.char.replace(datetimes.astype(str), '-', '/'), 'T', '/')